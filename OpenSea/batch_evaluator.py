@@ -0,0 +1,196 @@
+from OpenSea.price_history import WINDOWS, window_index
+from OpenSea.blacklist_index import BlacklistIndex
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+
+class UserColumns:
+    """Пороги из OpenSeaConfig всех пользователей в виде колонок NumPy"""
+
+    def __init__(self, configs_items: list, blacklist_index: BlacklistIndex = None):
+        self.user_ids = [user_id for user_id, _ in configs_items]
+        self.configs  = [config  for _, config  in configs_items]
+        self.columns  = {user_id: column for column, user_id in enumerate(self.user_ids)}
+
+        inf = float('inf')
+
+        self.top_volume = np.array([config.top_N_by_1d_volume or inf for config in self.configs], dtype=np.float64)
+        self.min_volume = np.array([config.min_USD_1d_volume  or 0   for config in self.configs], dtype=np.float64)
+        self.max_volume = np.array([config.max_USD_1d_volume  or inf for config in self.configs], dtype=np.float64)
+        self.min_price  = np.array([config.min_USD_top_offer  or 0   for config in self.configs], dtype=np.float64)
+        self.max_price  = np.array([config.max_USD_top_offer  or inf for config in self.configs], dtype=np.float64)
+        self.diff       = np.array([config.diff_percent_offer_to_floor or 0 for config in self.configs], dtype=np.float64)
+
+        self.floor_drop_percent = np.array([config.floor_drop_percent or inf for config in self.configs], dtype=np.float64)
+        self.offer_rise_percent = np.array([config.offer_rise_percent or inf for config in self.configs], dtype=np.float64)
+        self.floor_drop_window  = np.array([window_index(config.floor_drop_window) for config in self.configs], dtype=np.intp)
+        self.offer_rise_window  = np.array([window_index(config.offer_rise_window) for config in self.configs], dtype=np.intp)
+
+        self.notification_cooldown = [config.notification_cooldown or 0 for config in self.configs]
+        self.percent_step          = [config.percent_step or 0 for config in self.configs]
+
+        # Общий индекс NotifyCreator или воркера, без него - индекс только этих пользователей
+        self.blacklist_index = blacklist_index or BlacklistIndex(dict(configs_items))
+
+
+
+    def __len__(self):
+        return len(self.user_ids)
+
+
+
+class CollectionColumns:
+    """Поля пачки коллекций, которые нужны фильтрам, в виде колонок NumPy"""
+
+    def __init__(self, collections: list, volume_rank, full_scanned: bool, window_changes: tuple = None):
+        self.collections = collections
+        self.slugs = [collection.slug for collection in collections]
+
+        nan = float('nan')
+        inf = float('inf')
+
+        self.volume = np.array([
+            volume if (volume := collection.volume_1d_usd) is not None else nan
+            for collection in collections
+        ], dtype=np.float64)
+
+        self.topOffer   = np.array([collection.offer_usd or 0 for collection in collections], dtype=np.float64)
+        self.floorPrice = np.array([collection.floor_usd or 0 for collection in collections], dtype=np.float64)
+
+        # Без полного скана рейтинг неизвестен, и фильтр топ N не проходит никто
+        self.rank = np.array([
+            rank if full_scanned and (rank := volume_rank.rank(slug)) is not None else inf
+            for slug in self.slugs
+        ], dtype=np.float64)
+
+        # Падение floor и рост topOffer в % по окнам WINDOWS, коллекции × окна
+        if window_changes:
+            self.floor_drop = np.array(window_changes[0], dtype=np.float64).reshape(len(collections), len(WINDOWS))
+            self.offer_rise = np.array(window_changes[1], dtype=np.float64).reshape(len(collections), len(WINDOWS))
+        else:
+            self.floor_drop = self.offer_rise = np.full((len(collections), len(WINDOWS)), np.nan)
+
+
+
+    @classmethod
+    def from_arrays(cls, slugs: list, volume, topOffer, floorPrice, rank, floor_drop, offer_rise) -> "CollectionColumns":
+        """Колонки поверх готовых массивов, например из shared memory, без записей коллекций"""
+        columns = cls.__new__(cls)
+
+        columns.collections = None
+        columns.slugs = slugs
+        columns.volume = volume
+        columns.topOffer = topOffer
+        columns.floorPrice = floorPrice
+        columns.rank = rank
+        columns.floor_drop = floor_drop
+        columns.offer_rise = offer_rise
+
+        return columns
+
+
+
+    def __len__(self):
+        return len(self.slugs)
+
+
+
+class BatchEvaluator:
+    """Считает матрицу совпадений коллекции × пользователи за один векторный проход"""
+
+    @staticmethod
+    def is_available() -> bool:
+        return np is not None
+
+
+
+    @staticmethod
+    def match(collections: CollectionColumns, users: UserColumns):
+        """Возвращает матрицу совпадений, diff offer/floor для каждой коллекции
+        и сработавшие оконные алерты (коллекции × пользователи, NaN если не сработал)"""
+
+        volume = collections.volume[:, None]
+        topOffer = collections.topOffer
+        floorPrice = collections.floorPrice
+
+        ## Фильтры
+
+        mask = np.ones((len(collections), len(users)), dtype=bool)
+
+        # Черные списки по обратному индексу: только пары, где slug исключен, без проверки каждого пользователя
+        columns = users.columns
+        for row, slug in enumerate(collections.slugs):
+            for user_id in users.blacklist_index.blocked_users(slug):
+                if (column := columns.get(user_id)) is not None:
+                    mask[row, column] = False
+
+        mask &= (users.top_volume == float('inf')) | (collections.rank[:, None] < users.top_volume)
+
+        mask &= (users.min_volume <= volume) & (volume <= users.max_volume)
+
+        mask &= (users.min_price <= topOffer[:, None]) & (topOffer[:, None] <= users.max_price)
+
+        ## Alerts
+
+        has_prices = (topOffer != 0) & (floorPrice != 0)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            diff_offer_to_floor = np.where(has_prices, (floorPrice - topOffer) / floorPrice * 100, np.nan)
+
+        diff_alert = ((diff_offer_to_floor != 0)[:, None]) & (diff_offer_to_floor[:, None] <= users.diff)
+
+        floor_drop = collections.floor_drop[:, users.floor_drop_window]
+        offer_rise = collections.offer_rise[:, users.offer_rise_window]
+
+        floor_drop_alert = floor_drop >= users.floor_drop_percent
+        offer_rise_alert = offer_rise >= users.offer_rise_percent
+
+        mask &= has_prices[:, None] & (diff_alert | floor_drop_alert | offer_rise_alert)
+
+        return (
+            mask,
+            diff_offer_to_floor,
+            np.where(floor_drop_alert, floor_drop, np.nan),
+            np.where(offer_rise_alert, offer_rise, np.nan),
+        )
+
+
+
+    @staticmethod
+    def select(collections: CollectionColumns, users: UserColumns, cooldowns, now: float) -> list[tuple]:
+        """Совпадения, прошедшие кулдаун и шаг процентов, запоминаются в cooldowns.
+
+        Возвращает (номер коллекции в пачке, user_id, diff, оконные алерты)
+        """
+        mask, diffs, floor_drops, offer_rises = BatchEvaluator.match(collections, users)
+
+        selected = []
+
+        for row, column in zip(*mask.nonzero()):
+            slug = collections.slugs[row]
+            user_id = users.user_ids[column]
+            notification_cooldown = users.notification_cooldown[column]
+            percent_step = users.percent_step[column]
+            diff = float(diffs[row])
+
+            if not cooldowns.is_cooldown_passed(slug, user_id, notification_cooldown, now):
+                continue
+
+            if not cooldowns.is_step_passed(slug, user_id, diff, percent_step):
+                continue
+
+            cooldowns.record(slug, user_id, now, notification_cooldown, diff, percent_step)
+
+            windowed = {}
+            if (floor_drop := floor_drops[row, column]) == floor_drop:
+                windowed['floor_drop'] = (float(floor_drop), WINDOWS[users.floor_drop_window[column]])
+            if (offer_rise := offer_rises[row, column]) == offer_rise:
+                windowed['offer_rise'] = (float(offer_rise), WINDOWS[users.offer_rise_window[column]])
+
+            selected.append((int(row), user_id, diff, windowed))
+
+        return selected
@@ -0,0 +1,106 @@
+import fnmatch, re
+
+
+PATTERN_CHARS = frozenset("*?[")
+
+
+def is_pattern(entry: str) -> bool:
+    """Запись черного списка с *, ? или [...] - шаблон fnmatch, иначе точный slug"""
+    return not PATTERN_CHARS.isdisjoint(entry)
+
+
+def compile_patterns(patterns) -> re.Pattern:
+    """Все шаблоны пользователя одним регулярным выражением"""
+    return re.compile("|".join(fnmatch.translate(pattern) for pattern in sorted(patterns)))
+
+
+
+class BlacklistIndex:
+    """Общий индекс черных списков: slug -> пользователи, которые его исключили.
+
+    Точные slug лежат в обратном индексе, шаблоны каждого пользователя собраны в одно регулярное выражение,
+    а результат шаблонов кэшируется по slug до следующего изменения шаблонов.
+    update() вызывается в потоке event loop и не меняет exact и patterns на месте, а собирает новые словари и подменяет ссылку,
+    поэтому поток executor всегда читает целый снимок. pattern_cache пополняет только читающий поток в blocked_users,
+    update() лишь заменяет его пустым словарем.
+    """
+
+    EMPTY = frozenset()
+
+    def __init__(self, configs: dict = None):
+        self.exact: dict[str, frozenset] = {}
+        self.patterns: dict[int, re.Pattern] = {}
+        self.pattern_cache: dict[str, frozenset] = {}
+
+        self.user_entries: dict[int, frozenset] = {}
+
+        # Пока индекс никто не читает, exact собирается на месте без копий
+        for user_id, config in (configs or {}).items():
+            self.update(user_id, config.blacklist, copy=False)
+
+
+
+    def update(self, user_id: int, blacklist, copy: bool = True):
+        """Пересобирает записи пользователя, если его черный список изменился"""
+        entries = frozenset(blacklist or ())
+        previous = self.user_entries.get(user_id, self.EMPTY)
+
+        if entries == previous:
+            return
+
+        if entries:
+            self.user_entries[user_id] = entries
+        else:
+            self.user_entries.pop(user_id, None)
+
+        new_slugs = {entry for entry in entries if not is_pattern(entry)}
+        old_slugs = {entry for entry in previous if not is_pattern(entry)}
+
+        if new_slugs != old_slugs:
+            exact = dict(self.exact) if copy else self.exact
+
+            for slug in old_slugs - new_slugs:
+                users = exact.get(slug, self.EMPTY) - {user_id}
+                if users:
+                    exact[slug] = users
+                else:
+                    exact.pop(slug, None)
+
+            for slug in new_slugs - old_slugs:
+                exact[slug] = exact.get(slug, self.EMPTY) | {user_id}
+
+            self.exact = exact
+
+        patterns = {entry for entry in entries if is_pattern(entry)}
+        if patterns != {entry for entry in previous if is_pattern(entry)}:
+            updated = dict(self.patterns)
+
+            if patterns:
+                updated[user_id] = compile_patterns(patterns)
+            else:
+                updated.pop(user_id, None)
+
+            self.patterns = updated
+            self.pattern_cache = {}
+
+
+
+    def blocked_users(self, slug: str) -> frozenset:
+        """Пользователи, у которых slug в черном списке"""
+        exact = self.exact.get(slug, self.EMPTY)
+
+        if not self.patterns:
+            return exact
+
+        cache = self.pattern_cache
+        if (matched := cache.get(slug)) is None:
+            matched = cache[slug] = frozenset(
+                user_id for user_id, regex in self.patterns.items() if regex.match(slug)
+            )
+
+        return exact | matched if matched else exact
+
+
+
+    def __len__(self):
+        return len(self.user_entries)
@@ -0,0 +1,59 @@
+import gzip, json, pathlib, threading, time
+
+
+class CaptureWriter:
+    """Пишет сырые WebSocket сообщения и страницы топ листа с временем прихода в gzip JSONL для replay.
+
+    Строка лога: {"t": unix время, "kind": "ws" | "page" | "scan", "data": сырой текст}.
+    "scan" отмечает конец полного скана, страницы до него собираются в один снимок.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self.path = pathlib.Path(path)
+        self.file = gzip.open(self.path, "at", encoding="utf-8")
+
+        # Страницы последовательного скана пишутся из потока executor
+        self.lock = threading.Lock()
+
+        self.stats = {
+            "ws": 0,
+            "page": 0,
+            "scan": 0,
+        }
+
+
+
+    def write(self, kind: str, data: str | bytes = None):
+        if isinstance(data, bytes):
+            data = data.decode("utf-8")
+
+        line = json.dumps({"t": time.time(), "kind": kind, "data": data}, ensure_ascii=False)
+
+        with self.lock:
+            if self.file.closed:
+                return
+
+            self.file.write(line + "\n")
+            self.stats[kind] += 1
+
+
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+
+def read_capture(path: pathlib.Path):
+    """Читает лог CaptureWriter построчно: (время, вид, данные)"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                yield entry["t"], entry["kind"], entry["data"]
+
+        # Хвост лога может быть оборван при аварийной остановке
+        except (EOFError, json.JSONDecodeError):
+            return
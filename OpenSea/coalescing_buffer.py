@@ -0,0 +1,111 @@
+import asyncio, time
+from collections import OrderedDict
+
+from metrics import Metrics
+
+
+class CoalescingBuffer:
+    """Очередь коллекций на проверку уведомлений, где у каждого slug хранится только последнее состояние.
+
+    Новое обновление коллекции, которая уже ждет проверки, заменяет старое и не меняет ее место в очереди.
+    """
+
+    OVERLOAD_POLICIES = ("drop_oldest", "drop_newest", "block")
+
+    def __init__(self, max_size: int = 10_000, overload_policy: str = "drop_oldest"):
+        if overload_policy not in self.OVERLOAD_POLICIES:
+            raise ValueError(f"Unknown overload policy: {overload_policy}")
+
+        self.max_size = max_size
+        self.overload_policy = overload_policy
+
+        self.pending: OrderedDict[str, object] = OrderedDict()
+        self.enqueued_at: dict[str, float] = {}   # время первого ожидающего обновления slug
+
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+
+        self.stats = {
+            "puts": 0,
+            "coalesced": 0,
+            "dropped": 0,
+            "max_depth": 0,
+        }
+
+
+
+    def qsize(self) -> int:
+        return len(self.pending)
+
+    __len__ = qsize
+
+
+
+    def empty(self) -> bool:
+        return not self.pending
+
+
+
+    async def put(self, collection):
+        """Добавляет коллекцию или заменяет ее ожидающее состояние"""
+        slug = collection.slug
+        pending = self.pending
+        stats = self.stats
+
+        stats["puts"] += 1
+
+        if slug in pending:
+            pending[slug] = collection
+            stats["coalesced"] += 1
+            return
+
+        if len(pending) >= self.max_size:
+
+            if self.overload_policy == "drop_newest":
+                stats["dropped"] += 1
+                return
+
+            if self.overload_policy == "drop_oldest":
+                dropped_slug, _ = pending.popitem(last=False)
+                self.enqueued_at.pop(dropped_slug, None)
+                stats["dropped"] += 1
+
+            else:
+                while len(self.pending) >= self.max_size:
+                    self._not_full.clear()
+                    await self._not_full.wait()
+
+                if slug in pending:
+                    pending[slug] = collection
+                    stats["coalesced"] += 1
+                    return
+
+        pending[slug] = collection
+        self.enqueued_at[slug] = time.perf_counter()
+        stats["max_depth"] = max(stats["max_depth"], len(pending))
+        self._not_empty.set()
+
+
+
+    async def get_batch(self, max_items: int) -> list:
+        """Ждет первую коллекцию и забирает до max_items коллекций в порядке их первого изменения"""
+        while not self.pending:
+            self._not_empty.clear()
+            await self._not_empty.wait()
+
+        pending = self.pending
+        enqueued_at = self.enqueued_at
+        now = time.perf_counter()
+
+        batch = []
+        for _ in range(min(max_items, len(pending))):
+            slug, collection = pending.popitem(last=False)
+            Metrics.queue_wait.observe(now - enqueued_at.pop(slug, now))
+            batch.append(collection)
+
+        if not pending:
+            self._not_empty.clear()
+
+        self._not_full.set()
+
+        return batch
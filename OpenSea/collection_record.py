@@ -0,0 +1,107 @@
+from OpenSea.utils import get_usd_price, get_native_price, get_1d_volume
+
+
+class CollectionRecord:
+    """Компактная запись коллекции: только поля, которые читает NotifyCreator.
+
+    diff_percent считается один раз при создании и merge, version растет при каждом изменении полей,
+    чтобы NotifyCreator мог кэшировать отрисованный текст уведомления по (slug, version).
+    """
+
+    FIELDS = (
+        "slug",
+        "floor_usd",
+        "floor_native",
+        "floor_currency",
+        "offer_usd",
+        "offer_native",
+        "offer_currency",
+        "volume_1d_usd",
+    )
+
+    __slots__ = FIELDS + ("diff_percent", "version")
+
+    PRICE_FIELDS = ("floor_usd", "offer_usd")
+    ALERT_FIELDS = ("floor_usd", "offer_usd", "volume_1d_usd")
+
+    def __init__(
+            self,
+            slug: str,
+            floor_usd: float = None,
+            floor_native: float = None,
+            floor_currency: str = None,
+            offer_usd: float = None,
+            offer_native: float = None,
+            offer_currency: str = None,
+            volume_1d_usd: float = None
+        ):
+        self.slug = slug
+        self.floor_usd = floor_usd
+        self.floor_native = floor_native
+        self.floor_currency = floor_currency
+        self.offer_usd = offer_usd
+        self.offer_native = offer_native
+        self.offer_currency = offer_currency
+        self.volume_1d_usd = volume_1d_usd
+
+        self.version = 0
+        self.update_derived()
+
+
+
+    def update_derived(self):
+        """diff topOffer/floor в процентах, None если нет одной из цен"""
+        if self.floor_usd and self.offer_usd:
+            self.diff_percent = (self.floor_usd - self.offer_usd) / self.floor_usd * 100
+        else:
+            self.diff_percent = None
+
+
+
+    @classmethod
+    def from_graphql(cls, item: dict) -> "CollectionRecord":
+        """Создает запись из ответа GraphQL (топ лист или подписка), остальные поля отбрасываются"""
+        floor = get_native_price(item, "floorPrice") or {}
+        offer = get_native_price(item, "topOffer") or {}
+
+        return cls(
+            slug=item["slug"],
+            floor_usd=get_usd_price(item, "floorPrice"),
+            floor_native=floor.get("price"),
+            floor_currency=floor.get("currency"),
+            offer_usd=get_usd_price(item, "topOffer"),
+            offer_native=offer.get("price"),
+            offer_currency=offer.get("currency"),
+            volume_1d_usd=get_1d_volume(item),
+        )
+
+
+
+    def snapshot(self) -> "CollectionRecord":
+        """Неизменяемая копия для потока executor: merge в потоке event loop меняет запись на месте"""
+        record = CollectionRecord.__new__(CollectionRecord)
+        for field in self.__slots__:
+            setattr(record, field, getattr(self, field))
+        return record
+
+
+
+    def differs(self, new_record: "CollectionRecord", fields: tuple = FIELDS) -> bool:
+        return any(getattr(self, field) != getattr(new_record, field) for field in fields)
+
+
+
+    def merge(self, new_record: "CollectionRecord") -> bool:
+        """Переносит поля новой записи. Возвращает True, если изменились floor или topOffer в USD"""
+        changed = self.differs(new_record, self.PRICE_FIELDS)
+
+        if not self.differs(new_record):
+            return changed
+
+        for field in self.FIELDS:
+            setattr(self, field, getattr(new_record, field))
+
+        self.version += 1
+        self.update_derived()
+
+        return changed
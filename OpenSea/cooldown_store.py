@@ -0,0 +1,192 @@
+import heapq, sys
+
+
+class CooldownStore:
+    """Время последнего уведомления и последний diff по паре (slug, пользователь).
+
+    Пара хранится под одним int ключом: номер slug << 32 | номер пользователя.
+    Запись живет notification_cooldown секунд, а при включенном percent_step - не меньше step_ttl,
+    после чего удаляется по очереди истечения (min-heap). Чтение отсутствующей пары ничего не создает.
+    Используется только из потока executor NotifyCreator.
+    """
+
+    USER_BITS = 32
+
+    def __init__(self, step_ttl: float = 86400):
+        self.step_ttl = step_ttl   # секунд хранения diff для percent_step после последнего уведомления
+
+        self.slug_ids: dict[str, int] = {}
+        self.user_ids: dict[int, int] = {}
+
+        self.last_notifications: dict[int, float] = {}
+        self.last_diffs: dict[int, float] = {}
+        self.expires: dict[int, float] = {}
+
+        self.heap: list[tuple[float, int]] = []   # (время истечения, ключ), устаревшие записи пропускаются
+
+
+
+    def key(self, slug: str, user_id: int, create: bool = False) -> int:
+        slug_id = self.slug_ids.get(slug)
+        user_index = self.user_ids.get(user_id)
+
+        if slug_id is None or user_index is None:
+            if not create:
+                return None
+            slug_id = self.slug_ids.setdefault(slug, len(self.slug_ids))
+            user_index = self.user_ids.setdefault(user_id, len(self.user_ids))
+
+        return slug_id << self.USER_BITS | user_index
+
+
+
+    def last_notification(self, slug: str, user_id: int) -> float:
+        key = self.key(slug, user_id)
+        return self.last_notifications.get(key, 0) if key is not None else 0
+
+
+
+    def last_diff(self, slug: str, user_id: int) -> float:
+        key = self.key(slug, user_id)
+        return self.last_diffs.get(key, 0) if key is not None else 0
+
+
+
+    def is_cooldown_passed(self, slug: str, user_id: int, notification_cooldown: float, now: float) -> bool:
+        previous_notification = self.last_notification(slug, user_id)
+
+        if notification_cooldown and previous_notification \
+            and now - previous_notification < notification_cooldown:
+            return False
+
+        return True
+
+
+
+    def is_step_passed(self, slug: str, user_id: int, diff: float, percent_step: float) -> bool:
+        """diff сдвинулся от прошлого уведомления хотя бы на percent_step процентов прошлого diff"""
+        if not percent_step:
+            return True
+
+        previous_diff = self.last_diff(slug, user_id)
+
+        if previous_diff == 0:
+            return True
+
+        step_size = previous_diff * (percent_step / 100)
+
+        return abs(diff - previous_diff) >= step_size
+
+
+
+    def record(self, slug: str, user_id: int, now: float, notification_cooldown: float = 0, diff: float = None, percent_step: float = 0):
+        """Запоминает уведомление: время при заданном cooldown и diff при заданном percent_step"""
+        ttl = max(notification_cooldown or 0, self.step_ttl if percent_step else 0)
+        if not ttl:
+            return
+
+        key = self.key(slug, user_id, create=True)
+
+        if notification_cooldown:
+            self.last_notifications[key] = now
+        if percent_step:
+            self.last_diffs[key] = diff
+
+        expires_at = max(now + ttl, self.expires.get(key, 0))
+        if expires_at != self.expires.get(key):
+            self.expires[key] = expires_at
+            heapq.heappush(self.heap, (expires_at, key))
+
+
+
+    def forget_users(self, user_ids) -> int:
+        """Удаляет пары пользователей, например после смены их конфигов. Записи в heap пропустятся при истечении"""
+        indexes = {self.user_ids[user_id] for user_id in user_ids if user_id in self.user_ids}
+        if not indexes:
+            return 0
+
+        mask = (1 << self.USER_BITS) - 1
+        keys = [key for key in self.expires if key & mask in indexes]
+
+        for key in keys:
+            del self.expires[key]
+            self.last_notifications.pop(key, None)
+            self.last_diffs.pop(key, None)
+
+        return len(keys)
+
+
+
+    def expire(self, now: float) -> int:
+        """Удаляет истекшие пары, возвращает их количество"""
+        heap = self.heap
+        expired = 0
+
+        while heap and heap[0][0] <= now:
+            expires_at, key = heapq.heappop(heap)
+
+            if self.expires.get(key) != expires_at:
+                continue
+
+            del self.expires[key]
+            self.last_notifications.pop(key, None)
+            self.last_diffs.pop(key, None)
+            expired += 1
+
+        return expired
+
+
+
+    def __len__(self):
+        return len(self.expires)
+
+
+
+    def memory_usage(self) -> int:
+        """Примерный размер в байтах: словари, heap и числа в них"""
+        float_size = sys.getsizeof(0.0)
+        return (
+            sum(sys.getsizeof(container) for container in (
+                self.slug_ids, self.user_ids, self.last_notifications, self.last_diffs, self.expires, self.heap
+            ))
+            + (len(self.last_notifications) + len(self.last_diffs) + 2 * len(self.expires)) * float_size
+            + len(self.heap) * sys.getsizeof((0.0, 0))
+        )
+
+
+
+    def dump(self) -> dict:
+        """Состояние для снимка: записи по строкам slug и user_id, а не по внутренним номерам"""
+        slugs = {slug_id: slug for slug, slug_id in self.slug_ids.items()}
+        users = {index: user_id for user_id, index in self.user_ids.items()}
+        mask = (1 << self.USER_BITS) - 1
+
+        return {
+            "entries": [
+                (
+                    slugs[key >> self.USER_BITS],
+                    users[key & mask],
+                    self.last_notifications.get(key),
+                    self.last_diffs.get(key),
+                    expires_at,
+                )
+                for key, expires_at in self.expires.items()
+            ]
+        }
+
+
+
+    def load(self, state: dict, now: float):
+        for slug, user_id, last_notification, last_diff, expires_at in state.get("entries", []):
+            if expires_at <= now:
+                continue
+
+            key = self.key(slug, user_id, create=True)
+
+            if last_notification is not None:
+                self.last_notifications[key] = last_notification
+            if last_diff is not None:
+                self.last_diffs[key] = last_diff
+
+            self.expires[key] = expires_at
+            heapq.heappush(self.heap, (expires_at, key))
@@ -0,0 +1,427 @@
+import logging
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s:%(levelname)s:%(funcName)s: %(message)s",
+    datefmt="%H:%M:%S"
+)
+logger = logging.getLogger(__name__)
+
+import multiprocessing, threading
+from multiprocessing.shared_memory import SharedMemory
+
+from OpenSea.batch_evaluator import BatchEvaluator, UserColumns, CollectionColumns, np
+from OpenSea.cooldown_store import CooldownStore
+from OpenSea.blacklist_index import BlacklistIndex
+from OpenSea.price_history import WINDOWS
+
+
+
+class SharedBatch:
+    """Колонки пачки коллекций в одном блоке shared memory.
+
+    float64 поля × capacity строк, смещения slug в байтах и сами slug в UTF-8.
+    Главный процесс пишет пачку, воркеры читают ее без копирования и pickle.
+    """
+
+    SCALARS = ("volume", "topOffer", "floorPrice", "rank")
+    FIELDS = len(SCALARS) + 2 * len(WINDOWS)   # + floor_drop и offer_rise по окнам
+
+    def __init__(self, capacity: int, slug_capacity: int, name: str = None):
+        self.capacity = capacity
+        self.slug_capacity = slug_capacity
+
+        values_size = self.FIELDS * capacity * 8
+        offsets_size = (capacity + 1) * 8
+
+        if name is None:
+            self.memory = SharedMemory(create=True, size=values_size + offsets_size + slug_capacity)
+        else:
+            self.memory = SharedMemory(name=name)
+
+        buffer = self.memory.buf
+        self.values = np.ndarray((self.FIELDS, capacity), dtype=np.float64, buffer=buffer)
+        self.offsets = np.ndarray((capacity + 1,), dtype=np.int64, buffer=buffer, offset=values_size)
+        self.slug_bytes = np.ndarray((slug_capacity,), dtype=np.uint8, buffer=buffer, offset=values_size + offsets_size)
+
+
+
+    @property
+    def name(self) -> str:
+        return self.memory.name
+
+
+
+    def fits(self, rows: int, slug_size: int) -> bool:
+        return rows <= self.capacity and slug_size <= self.slug_capacity
+
+
+
+    def write(self, columns: CollectionColumns, encoded: bytes, offsets: list):
+        rows = len(columns)
+        windows = len(WINDOWS)
+        scalars = len(self.SCALARS)
+
+        self.values[0, :rows] = columns.volume
+        self.values[1, :rows] = columns.topOffer
+        self.values[2, :rows] = columns.floorPrice
+        self.values[3, :rows] = columns.rank
+        self.values[scalars:scalars + windows, :rows] = columns.floor_drop.T
+        self.values[scalars + windows:, :rows] = columns.offer_rise.T
+
+        self.offsets[:rows + 1] = offsets
+        self.slug_bytes[:len(encoded)] = np.frombuffer(encoded, dtype=np.uint8)
+
+
+
+    def read(self, rows: int) -> CollectionColumns:
+        """Колонки первых rows строк, массивы - представления shared memory до следующей записи"""
+        windows = len(WINDOWS)
+        scalars = len(self.SCALARS)
+
+        offsets = self.offsets[:rows + 1].tolist()
+        encoded = self.slug_bytes[:offsets[-1]].tobytes()
+        slugs = [encoded[start:end].decode() for start, end in zip(offsets, offsets[1:])]
+
+        return CollectionColumns.from_arrays(
+            slugs,
+            volume=self.values[0, :rows],
+            topOffer=self.values[1, :rows],
+            floorPrice=self.values[2, :rows],
+            rank=self.values[3, :rows],
+            floor_drop=self.values[scalars:scalars + windows, :rows].T,
+            offer_rise=self.values[scalars + windows:, :rows].T,
+        )
+
+
+
+    def close(self, unlink: bool = False):
+        # Представления держат buffer, без их удаления close() падает с BufferError
+        del self.values, self.offsets, self.slug_bytes
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+
+
+def run_worker(connection, name: str, capacity: int, slug_capacity: int):
+    """Процесс воркера: конфиги и кулдауны своей доли пользователей, команды из connection"""
+    batch = SharedBatch(capacity, slug_capacity, name)
+    configs = {}
+    users = None
+    cooldowns = CooldownStore()
+    blacklist_index = BlacklistIndex()
+
+    while True:
+        command, *args = connection.recv()
+
+        if command == "evaluate":
+            rows, now, user_ids = args
+            cooldowns.expire(now)
+
+            if user_ids is not None:
+                selected_users = UserColumns([(user_id, configs[user_id]) for user_id in user_ids if user_id in configs], blacklist_index)
+            else:
+                if users is None:
+                    users = UserColumns(list(configs.items()), blacklist_index)
+                selected_users = users
+
+            selected = BatchEvaluator.select(batch.read(rows), selected_users, cooldowns, now) if len(selected_users) else []
+            connection.send((selected, len(cooldowns), cooldowns.memory_usage()))
+
+        elif command == "configs":
+            configs.update(args[0])
+            users = None
+
+            # Воркер однопоточный, индекс можно менять на месте
+            for user_id, config in args[0].items():
+                blacklist_index.update(user_id, config.blacklist, copy=False)
+
+        elif command == "attach":
+            batch.close()
+            batch = SharedBatch(*args[1:], name=args[0])
+
+        elif command == "dump":
+            connection.send(cooldowns.dump())
+
+        elif command == "load":
+            cooldowns.load(*args)
+
+        elif command == "stop":
+            batch.close()
+            break
+
+
+
+class EvaluationPool:
+    """Проверка уведомлений в нескольких процессах: пользователи делятся по user_id % processes.
+
+    Каждый воркер держит конфиги и кулдауны своих пользователей, пачка коллекций передается
+    через SharedBatch, обратно приходят только совпадения (номер коллекции, user_id, diff, оконные алерты).
+    Методы, кроме stage_configs, вызываются из одного потока executor NotifyCreator.
+
+    Упавший воркер перезапускается, его доля пользователей в restoring проверяется в потоке NotifyCreator
+    по копии кулдаунов, пока воркер не получит все конфиги и кулдауны из этой копии.
+    """
+
+    SLUG_BYTES = 64   # начальный запас байт на slug, блок пересоздается при нехватке
+
+    def __init__(self, processes: int, capacity: int):
+        self.context = multiprocessing.get_context("spawn")
+
+        self.batch = SharedBatch(capacity, capacity * self.SLUG_BYTES)
+
+        self.connections = [None] * processes
+        self.processes = [None] * processes
+
+        for index in range(processes):
+            self.start_worker(index)
+
+        # Воркеры с оборванным соединением до перезапуска и перезапущенные воркеры без конфигов
+        self.failed: set[int] = set()
+        self.restoring: set[int] = set()
+
+        # Копии измененных конфигов из потока event loop до следующей пачки
+        self.lock = threading.Lock()
+        self.pending: dict = {}
+        self.pending_full = False
+        self.changed: set = set()
+        self.all_changed = True
+
+        self.stats = {
+            "processes": processes,
+            "batches": 0,
+            "matches": 0,
+            "resizes": 0,
+            "restarts": 0,
+            "cooldown_entries": 0,
+            "cooldown_bytes": 0,
+        }
+
+
+
+    def start_worker(self, index: int):
+        connection, worker_connection = self.context.Pipe()
+        process = self.context.Process(
+            target=run_worker,
+            args=(worker_connection, self.batch.name, self.batch.capacity, self.batch.slug_capacity),
+            name=f"notify-worker-{index}",
+            daemon=True
+        )
+        process.start()
+
+        # Без закрытия своей копии конца воркера recv() ждет вечно, а не получает EOFError после его смерти
+        worker_connection.close()
+
+        self.connections[index] = connection
+        self.processes[index] = process
+
+
+
+    def send(self, index: int, message: tuple):
+        if index in self.failed:
+            return
+
+        try:
+            self.connections[index].send(message)
+        except (EOFError, OSError) as e:
+            logger.error(f"Воркер {index} недоступен: {e}")
+            self.failed.add(index)
+
+
+
+    def restart_failed(self):
+        """Перезапускает воркеры с оборванным соединением, их конфиги уйдут заново со следующей пачкой"""
+        for index in sorted(self.failed):
+            process = self.processes[index]
+            if process.is_alive():
+                process.kill()
+            process.join(timeout=5)
+            self.connections[index].close()
+
+            self.start_worker(index)
+            self.restoring.add(index)
+            self.stats["restarts"] += 1
+
+            logger.warning(f"Воркер {index} перезапущен (exitcode {process.exitcode})")
+
+        if self.failed:
+            self.failed.clear()
+            self.all_changed = True
+
+
+
+    def shard(self, user_id: int) -> int:
+        return user_id % len(self.connections)
+
+
+
+    def mark_changed(self, user_id: int):
+        """Конфиг пользователя изменен, воркер получит копию со следующей пачкой"""
+        self.changed.add(user_id)
+
+
+
+    def stage_configs(self, configs: dict):
+        """Копирует измененные конфиги в потоке event loop, где их меняют обработчики бота"""
+        full = self.all_changed
+        if full:
+            changed, self.all_changed = list(configs), False
+        else:
+            changed, self.changed = self.changed, set()
+
+        if not (changed or full):
+            return
+
+        copies = {
+            user_id: type(config)(config.save_config())
+            for user_id in changed if (config := configs.get(user_id)) is not None
+        }
+
+        with self.lock:
+            self.pending.update(copies)
+            self.pending_full = self.pending_full or full
+
+
+
+    def send_configs(self, fallback: CooldownStore = None, now: float = None):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            full, self.pending_full = self.pending_full, False
+
+        shards = [{} for _ in self.connections]
+        for user_id, config in pending.items():
+            shards[self.shard(user_id)][user_id] = config
+
+        for index, configs in enumerate(shards):
+            if configs:
+                self.send(index, ("configs", configs))
+
+        # Перезапущенные воркеры получили все конфиги и до первой пачки получают кулдауны своих пользователей из fallback
+        if full and self.restoring:
+            restored, self.restoring = self.restoring, set()
+
+            if fallback is not None:
+                entries = [entry for entry in fallback.dump()["entries"] if self.shard(entry[1]) in restored]
+                for index in restored:
+                    self.send(index, ("load", {"entries": [entry for entry in entries if self.shard(entry[1]) == index]}, now))
+
+
+
+    def write_batch(self, columns: CollectionColumns):
+        encoded_slugs = [slug.encode() for slug in columns.slugs]
+        offsets = [0]
+        for encoded in encoded_slugs:
+            offsets.append(offsets[-1] + len(encoded))
+
+        if not self.batch.fits(len(columns), offsets[-1]):
+            capacity = max(self.batch.capacity, len(columns))
+            slug_capacity = max(self.batch.slug_capacity, offsets[-1]) * 2
+
+            batch = SharedBatch(capacity, slug_capacity)
+            for index in range(len(self.connections)):
+                self.send(index, ("attach", batch.name, capacity, slug_capacity))
+
+            self.batch.close(unlink=True)
+            self.batch = batch
+            self.stats["resizes"] += 1
+
+            # Перезапущенный воркер откроет уже новый блок
+            self.restart_failed()
+
+        self.batch.write(columns, b"".join(encoded_slugs), offsets)
+
+
+
+    def evaluate(self, columns: CollectionColumns, now: float, user_ids: list = None, fallback: CooldownStore = None) -> list[tuple]:
+        """Совпадения работающих воркеров: (номер коллекции в пачке, user_id, diff, оконные алерты).
+
+        user_ids - проверить только этих пользователей, None - всех.
+        fallback - копия кулдаунов всех воркеров в вызывающем потоке: по ней после вызова проверяются
+        пользователи воркеров из restoring, и из нее перезапущенный воркер получает кулдауны своей доли.
+        """
+        self.send_configs(fallback, now)
+        self.write_batch(columns)
+
+        for index in range(len(self.connections)):
+            self.send(index, ("evaluate", len(columns), now, user_ids))
+
+        selected = []
+        entries = memory = 0
+
+        # Следующая пачка пишется в shared memory только после ответа всех воркеров,
+        # ответ читается у каждого живого воркера, чтобы в канале не осталось старых ответов
+        for index, connection in enumerate(self.connections):
+            if index in self.failed:
+                continue
+
+            try:
+                matches, worker_entries, worker_memory = connection.recv()
+            except (EOFError, OSError) as e:
+                logger.error(f"Воркер {index} не ответил: {e!r}")
+                self.failed.add(index)
+                continue
+
+            selected.extend(matches)
+            entries += worker_entries
+            memory += worker_memory
+
+        self.restart_failed()
+
+        stats = self.stats
+        stats["batches"] += 1
+        stats["matches"] += len(selected)
+        stats["cooldown_entries"] = entries
+        stats["cooldown_bytes"] = memory
+
+        return selected
+
+
+
+    def is_restoring(self, user_id: int) -> bool:
+        return self.shard(user_id) in self.restoring
+
+
+
+    def dump(self) -> dict:
+        entries = []
+
+        for index in range(len(self.connections)):
+            self.send(index, ("dump",))
+
+        for index, connection in enumerate(self.connections):
+            if index in self.failed:
+                continue
+
+            try:
+                entries.extend(connection.recv()["entries"])
+            except (EOFError, OSError) as e:
+                logger.error(f"Воркер {index} не ответил: {e!r}")
+                self.failed.add(index)
+
+        self.restart_failed()
+
+        return {"entries": entries}
+
+
+
+    def load(self, state: dict, now: float):
+        shards = [[] for _ in self.connections]
+        for entry in state.get("entries", []):
+            shards[self.shard(entry[1])].append(entry)
+
+        for index, entries in enumerate(shards):
+            self.send(index, ("load", {"entries": entries}, now))
+
+        self.restart_failed()
+
+
+
+    def close(self):
+        for connection, process in zip(self.connections, self.processes):
+            try:
+                connection.send(("stop",))
+            except OSError:
+                pass
+            process.join(timeout=5)
+
+        self.batch.close(unlink=True)
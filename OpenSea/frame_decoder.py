@@ -0,0 +1,203 @@
+import json, time
+from typing import Optional
+
+from OpenSea.collection_record import CollectionRecord
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+
+class DecodedFrame:
+    """Сообщение WebSocket: тип, id подписки и запись коллекции, если она есть"""
+
+    __slots__ = ("type", "id", "record", "payload")
+
+    def __init__(self, type: str, id: str = None, record: CollectionRecord = None, payload=None):
+        self.type = type
+        self.id = id
+        self.record = record
+        self.payload = payload   # сырой payload только для служебных сообщений (ошибки и т.п.)
+
+
+
+if msgspec:
+
+    class _Native(msgspec.Struct):
+        unit: Optional[float] = None
+        symbol: Optional[str] = None
+
+    class _PricePerItem(msgspec.Struct):
+        usd: Optional[float] = None
+        native: Optional[_Native] = None
+
+    class _Price(msgspec.Struct):
+        pricePerItem: Optional[_PricePerItem] = None
+
+    class _Volume(msgspec.Struct):
+        usd: Optional[float] = None
+
+    class _Window(msgspec.Struct):
+        volume: Optional[_Volume] = None
+
+    class _Stats(msgspec.Struct):
+        oneDay: Optional[_Window] = None
+
+    class _Collection(msgspec.Struct):
+        slug: Optional[str] = None
+        floorPrice: Optional[_Price] = None
+        topOffer: Optional[_Price] = None
+        stats: Optional[_Stats] = None
+
+    class _Data(msgspec.Struct):
+        collectionsBySlugs: Optional[_Collection] = None
+
+    class _Payload(msgspec.Struct):
+        data: Optional[_Data] = None
+
+    class _Frame(msgspec.Struct):
+        type: str
+        id: Optional[str] = None
+        payload: Optional[_Payload] = None
+
+
+
+class FrameDecoder:
+    """Декодирует сообщения подписки collectionsBySlugs сразу в CollectionRecord.
+
+    msgspec разбирает только нужные поля по схеме, orjson и json строят полный dict.
+    Сообщения, которые не подходят под схему (ошибки), разбираются через json.
+    """
+
+    BACKENDS = ("msgspec", "orjson", "json")
+
+    def __init__(self, backend: str = None):
+        self.backend = backend or self.best_backend()
+
+        if self.backend == "msgspec":
+            self._decoder = msgspec.json.Decoder(_Frame)
+            self.decode = self.decode_msgspec
+        elif self.backend == "orjson":
+            self.decode = self.decode_orjson
+        else:
+            self.decode = self.decode_json
+
+
+
+    @staticmethod
+    def available_backends() -> list[str]:
+        return [
+            backend for backend, module in zip(FrameDecoder.BACKENDS, (msgspec, orjson, json))
+            if module is not None
+        ]
+
+
+
+    @staticmethod
+    def best_backend() -> str:
+        return FrameDecoder.available_backends()[0]
+
+
+
+    @staticmethod
+    def _price(price) -> tuple:
+        if not price or not (per_item := price.pricePerItem):
+            return None, None, None
+
+        native = per_item.native
+        if native and native.unit and native.symbol:
+            return per_item.usd, native.unit, native.symbol
+
+        return per_item.usd, None, None
+
+
+
+    def decode_msgspec(self, data) -> DecodedFrame:
+        try:
+            frame = self._decoder.decode(data)
+        except msgspec.ValidationError:
+            return self.decode_json(data)
+
+        record = None
+
+        if frame.payload and frame.payload.data and (collection := frame.payload.data.collectionsBySlugs) and collection.slug:
+
+            floor_usd, floor_native, floor_currency = self._price(collection.floorPrice)
+            offer_usd, offer_native, offer_currency = self._price(collection.topOffer)
+
+            stats = collection.stats
+            volume = stats.oneDay.volume if stats and stats.oneDay else None
+
+            record = CollectionRecord(
+                slug=collection.slug,
+                floor_usd=floor_usd,
+                floor_native=floor_native,
+                floor_currency=floor_currency,
+                offer_usd=offer_usd,
+                offer_native=offer_native,
+                offer_currency=offer_currency,
+                volume_1d_usd=volume.usd if volume else None,
+            )
+
+        return DecodedFrame(frame.type, frame.id, record)
+
+
+
+    def from_dict(self, message_data: dict) -> DecodedFrame:
+        payload = message_data.get("payload")
+
+        if isinstance(payload, dict) \
+            and (data := payload.get("data")) \
+            and (collection := data.get("collectionsBySlugs")) \
+            and collection.get("slug"):
+                return DecodedFrame(message_data.get("type"), message_data.get("id"), CollectionRecord.from_graphql(collection))
+
+        return DecodedFrame(message_data.get("type"), message_data.get("id"), None, None if message_data.get("type") == "next" else payload)
+
+
+
+    def decode_orjson(self, data) -> DecodedFrame:
+        return self.from_dict(orjson.loads(data))
+
+
+
+    def decode_json(self, data) -> DecodedFrame:
+        return self.from_dict(json.loads(data))
+
+
+
+def benchmark(frames: list, repeat: int = 5) -> dict[str, float]:
+    """Средняя стоимость декодирования одного сообщения в микросекундах для каждого доступного backend"""
+    results = {}
+
+    for backend in FrameDecoder.available_backends():
+        decode = FrameDecoder(backend).decode
+
+        started = time.perf_counter()
+        for _ in range(repeat):
+            for frame in frames:
+                decode(frame)
+        duration = time.perf_counter() - started
+
+        results[backend] = duration / (repeat * len(frames)) * 1_000_000
+
+    return results
+
+
+
+if __name__ == "__main__":
+    import sys
+
+    # Файл с записанными сообщениями WebSocket, по одному JSON на строку
+    with open(sys.argv[1], "rb") as f:
+        frames = [line.strip() for line in f if line.strip()]
+
+    for backend, microseconds in benchmark(frames).items():
+        print(f"{backend:8} {microseconds:8.2f} µs/message ({len(frames)} messages)")
@@ -6,67 +6,134 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-import asyncio, time, heapq
-from collections import defaultdict
-from OpenSea.utils import get_usd_price, get_native_price
+import asyncio, time
+from concurrent.futures import ThreadPoolExecutor
+from OpenSea.batch_evaluator import BatchEvaluator, UserColumns, CollectionColumns
+from OpenSea.price_history import WINDOWS, window_index
+from OpenSea.cooldown_store import CooldownStore
+from OpenSea.evaluation_pool import EvaluationPool
+from OpenSea.blacklist_index import BlacklistIndex
+from metrics import Metrics
 
 class NotifyCreator:
+
+    REEVALUATE_DELAY = 2.0 # seconds, правки конфигов подряд собираются в одну повторную проверку
+
     def __init__(self, scraper):
         self.scraper = scraper
         self.slugs_data = scraper.slugs_data
-
+        self.volume_rank = scraper.volume_rank
+        self.price_history = scraper.price_history
 
         self.configs = scraper.configs
         self.notification_managers = scraper.notification_managers
 
         self.notification_queue = scraper.notification_queue
+        self.batch_size = 1000
 
-        self.last_notifications = defaultdict(lambda: defaultdict(lambda: 0))
-        self.last_diffs         = defaultdict(lambda: defaultdict(lambda: 0))
+        # Один поток владеет cooldowns и не делит default executor со сканером топ листа
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="notify")
 
+        self.batch_stats = {
+            "batches": 0,
+            "collections": 0,
+            "notifications": 0,
+            "last_duration": 0.0,
+            "max_duration": 0.0,
+            "total_duration": 0.0,
+            "reevaluations": 0,
+            "reevaluated_users": 0,
+        }
 
+        # slug -> (version записи, {оконные алерты: текст}), только поток executor
+        self.render_cache: dict[str, tuple[int, dict]] = {}
 
-    def is_blacklisted(self, new_collection, blacklist):
-        return new_collection["slug"] in blacklist
+        # Время последнего уведомления и diff по (slug, пользователь) с истечением по notification_cooldown
+        self.cooldowns = CooldownStore()
 
+        # Пул процессов с пользователями, поделенными по user_id, в нем же живут их кулдауны
+        self.pool = None
+        if scraper.evaluation_processes:
+            if BatchEvaluator.is_available():
+                self.pool = EvaluationPool(scraper.evaluation_processes, self.batch_size)
+            else:
+                logger.warning("evaluation_processes требует numpy, проверка остается в потоке")
 
+        # slug -> пользователи, исключившие его точным slug или шаблоном
+        self.blacklist_index = BlacklistIndex(self.configs)
 
-    def is_top_N_1dVolume(self, new_collection, top_volume):
+        # Список конфигов пересобирается в потоке event loop только после изменения конфигов,
+        # колонки пользователей в потоке executor - только для нового списка
+        self.configs_version = 0
+        self.configs_items: list = None
+        self.configs_items_version = -1
+        self.user_columns: tuple[list, UserColumns] = None
 
-        if not self.scraper.full_scanned or 0 >= top_volume:
-            return False
+        # Пользователи со свежими конфигами, которых нужно проверить по всем коллекциям slugs_data
+        self.reevaluate_users: set[int] = set()
+        self.reevaluate_event = asyncio.Event()
 
 
 
-        old_collections = [old_collection for old_collection in self.slugs_data.values() if old_collection.get("stats") is not None]
+    def dump_state(self) -> dict:
+        """Состояние кулдаунов и шагов для снимка. Вызывается в потоке executor"""
+        if self.pool:
+            return {"cooldowns": self.pool.dump()}
 
-        top_N = heapq.nlargest(
-            top_volume,
-            old_collections,
-            key=lambda collection: collection["stats"]["oneDay"]["volume"]["usd"]
-        )
-        # logger.debug(f"{top_volume} {len(top_N)}")
-        if top_N \
-            and any(collection['slug'] == new_collection['slug'] for collection in top_N):
-                return True
-        
-        return False
+        return {"cooldowns": self.cooldowns.dump()}
+
+
+
+    def load_state(self, state: dict):
+        now = time.time()
+
+        if "cooldowns" in state:
+            self.cooldowns.load(state["cooldowns"], now)
+
+        # Снимки прошлых версий: словари slug -> user_id -> значение без времени истечения
+        for slug, users in state.get("last_notifications", {}).items():
+            for user_id, last_notification in users.items():
+                if last_notification:
+                    self.cooldowns.record(slug, user_id, last_notification, self.cooldowns.step_ttl)
+
+        for slug, users in state.get("last_diffs", {}).items():
+            for user_id, last_diff in users.items():
+                if last_diff:
+                    self.cooldowns.record(slug, user_id, now, diff=last_diff, percent_step=1)
+
+        # cooldowns остаются копией кулдаунов воркеров
+        if self.pool:
+            self.pool.load(self.cooldowns.dump(), now)
+
+
+
+    def is_blacklisted(self, new_collection, user_id):
+        return user_id in self.blacklist_index.blocked_users(new_collection.slug)
+
+
+
+    def is_top_N_1dVolume(self, new_collection, top_volume):
+
+        if not self.scraper.full_scanned or 0 >= top_volume:
+            return False
+
+        return self.volume_rank.is_top_N(new_collection.slug, top_volume)
 
 
 
     def is_in_range_1dVolume(self, new_collection, min_volume, max_volume):
-        # logger.debug(f"{min_volume} {new_collection['stats']['oneDay']['volume']['usd']} {max_volume}")
-        return (min_volume <= new_collection["stats"]["oneDay"]["volume"]["usd"] <= max_volume)
+        # logger.debug(f"{min_volume} {new_collection.volume_1d_usd} {max_volume}")
+        return new_collection.volume_1d_usd is not None and (min_volume <= new_collection.volume_1d_usd <= max_volume)
 
 
 
     def is_in_range_topOffer(self, new_collection, min_price, max_price):
-        # logger.debug(f"{min_price} {get_usd_price(new_collection, 'topOffer')} {max_price}")
-        return min_price <= (get_usd_price(new_collection, "topOffer") or 0) <= max_price
+        # logger.debug(f"{min_price} {new_collection.offer_usd} {max_price}")
+        return min_price <= (new_collection.offer_usd or 0) <= max_price
 
 
 
-    def custom_condition(self, new_collection, user_id):
+    def custom_condition(self, new_collection, user_id, window_change=None):
         """Фильтрация коллекций по настройкам пользователей и проверка условий для отправки уведомлений"""
         # Условие
         
@@ -77,8 +144,6 @@ class NotifyCreator:
             return False
 
 
-        blacklist = config.blacklist or set()
-
         top_volume = config.top_N_by_1d_volume or float('inf')
         min_volume = config.min_USD_1d_volume or 0
         max_volume = config.max_USD_1d_volume or float('inf')
@@ -91,7 +156,7 @@ class NotifyCreator:
 
         ## Фильтры
 
-        if self.is_blacklisted(new_collection, blacklist):
+        if self.is_blacklisted(new_collection, user_id):
             return False
 
         if top_volume < float('inf') and not self.is_top_N_1dVolume(new_collection, top_volume):
@@ -107,23 +172,38 @@ class NotifyCreator:
 
         ## Alerts
         
-        topOffer = get_usd_price(new_collection, "topOffer")
-        floorPrice = get_usd_price(new_collection, "floorPrice")
+        diff_offer_to_floor = new_collection.diff_percent
 
-        if not (topOffer and floorPrice):
+        if diff_offer_to_floor is None:
             return False
         
         
         conditions = {}
 
 
-        diff_offer_to_floor = (floorPrice - topOffer) / floorPrice * 100
         # logger.debug(f"Diff offer to floor: {diff_offer_to_floor:.2f}% {diff}")
         if diff_offer_to_floor <= diff:
             
             conditions['diff_percent_offer_to_floor'] = diff_offer_to_floor
 
 
+        # Оконные алерты: window_change = (падения floor по окнам, рост topOffer по окнам)
+        if window_change:
+            floor_drops, offer_rises = window_change
+
+            floor_drop_percent = config.floor_drop_percent or float('inf')
+            offer_rise_percent = config.offer_rise_percent or float('inf')
+
+            floor_drop = floor_drops[window_index(config.floor_drop_window)]
+            offer_rise = offer_rises[window_index(config.offer_rise_window)]
+
+            if floor_drop >= floor_drop_percent:
+                conditions['floor_drop'] = (floor_drop, WINDOWS[window_index(config.floor_drop_window)])
+
+            if offer_rise >= offer_rise_percent:
+                conditions['offer_rise'] = (offer_rise, WINDOWS[window_index(config.offer_rise_window)])
+
+
         if any(conditions.values()): # all(required_conditions) or any(not_required_conditions)
             return conditions
 
@@ -132,115 +212,299 @@ class NotifyCreator:
     
 
     def is_notification_cooldown_passed(self, collection, user_id, notification_cooldown):
-
-        now = time.time()
-
-        previous_notification = self.last_notifications[collection['slug']][user_id]
-        
-
-        # logger.debug(f"{now - previous_notification:.2f} {notification_cooldown}")
-        if notification_cooldown and previous_notification \
-            and now - previous_notification < notification_cooldown: 
-            return False
-
-        return True
+        return self.cooldowns.is_cooldown_passed(collection.slug, user_id, notification_cooldown, time.time())
 
 
 
     def is_diff_step_range_passed(self, user_id, collection, diff, percent_step):
-        if not percent_step:
-            return True
+        return self.cooldowns.is_step_passed(collection.slug, user_id, diff, percent_step)
 
-        previous_diff = self.last_diffs[collection['slug']][user_id]
 
-        if previous_diff==0:
-            return True
 
-        step_size = previous_diff * (percent_step / 100)
+    def build_notification(self, collection, windowed=None):
+        """Текст уведомления из кэша по версии записи, отрисовывается один раз на всех пользователей"""
+        extras = tuple(sorted(windowed.items())) if windowed else ()
 
-        percents_from_previous_diff = abs(diff - previous_diff)
+        cached = self.render_cache.get(collection.slug)
+        if cached is None or cached[0] != collection.version:
+            cached = self.render_cache[collection.slug] = (collection.version, {})
 
-        # logger.debug(f"{previous_diff} {percents_from_previous_diff:.2f} {step_size:.2f} {percent_step}")
-        if percents_from_previous_diff >= step_size:
-            return True
+        if (notification := cached[1].get(extras)) is None:
+            notification = cached[1][extras] = self.render_notification(collection, windowed)
 
-        return False
+        return notification
 
 
 
-    def build_notification(self, collection, diff):
+    def render_notification(self, collection, windowed=None):
         """Получаем цены и создаем уведомление"""
         
-        usd_price = (get_usd_price(collection, 'topOffer') or get_usd_price(collection, 'floorPrice') or 0)
-        topOffer   = get_native_price(collection, "topOffer")
-        floorPrice = get_native_price(collection, "floorPrice")
+        usd_price = (collection.offer_usd or collection.floor_usd or 0)
+
+        windowed_lines = "".join(
+            f"{title} {self.format_window(seconds)} - <b>{percent:.2f}%</b>\n"
+            for title, key in (("Floor drop", "floor_drop"), ("Offer rise", "offer_rise"))
+            if windowed and key in windowed
+            for percent, seconds in (windowed[key],)
+        )
 
         return (
 
-            f"Collection - {collection['slug']}\n"
+            f"Collection - {collection.slug}\n"
             f"Price - {usd_price:.2f}$\n"
-            f"List - {topOffer['price']} {topOffer['currency']}\n"
-            f"Floor - {floorPrice['price']} {floorPrice['currency']}\n"
-            f"Diff - <b>{diff:.2f}%</b>\n"
-            f"opensea.io/collection/{collection['slug']}"
+            f"List - {collection.offer_native} {collection.offer_currency}\n"
+            f"Floor - {collection.floor_native} {collection.floor_currency}\n"
+            f"Diff - <b>{collection.diff_percent:.2f}%</b>\n"
+            f"{windowed_lines}"
+            f"opensea.io/collection/{collection.slug}"
         
         )
 
 
+
+    @staticmethod
+    def format_window(seconds):
+        return f"{seconds // 3600}h" if seconds >= 3600 else f"{seconds // 60}m"
+
+
+
     async def wraper_check_for_notifications(self):
         """Обертка для проверки уведомлений"""
+        loop = asyncio.get_running_loop()
+
         while True:
-            collection = await self.notification_queue.get()
-            for user_id, config in self.configs.items():
-                notification = await asyncio.wait_for(asyncio.get_event_loop().run_in_executor(None, self.check_for_notifications, collection, user_id, config), timeout=60)
-                if notification:
-                    await self.notification_managers.add_message(user_id, notification)
+            # Проверка и текст уведомления используют одни и те же значения, даже если запись обновится во время пачки
+            collections = [collection.snapshot() for collection in await self.notification_queue.get_batch(self.batch_size)]
+            configs_items = self.current_configs_items()
 
-    def check_for_notifications(self, collection, user_id, config):
-        """Проверка условий и отправка уведомлений"""
-    
-        # logger.debug(f"Checking conditions for {user_id} on collection {collection['slug']}")
-        notification_cooldown = config.notification_cooldown or 0
-        percent_step = config.percent_step or 0
+            if self.pool:
+                self.pool.stage_configs(self.configs)
 
+            # История цен живет в потоке event loop, поэтому окна считаются здесь
+            window_changes = self.price_history.window_changes(collections)
 
-        # Проверка кулдауна с последнего уведомления по notification_cooldown в config
-        if not self.is_notification_cooldown_passed(collection, user_id, notification_cooldown):
-            return None
+            try:
+                notifications = await loop.run_in_executor(self.executor, self.evaluate_batch, collections, configs_items, window_changes)
+            except Exception as e:
+                logger.error(f"Ошибка при проверке уведомлений: {e}")
+                continue
 
+            for user_id, slug, notification in notifications:
+                await self.notification_managers.add_message(user_id, notification, key=slug)
 
-        conditions = self.custom_condition(collection, user_id)
 
-        
-        # logger.debug(f"{conditions} Проверка условий для {user_id} по коллекции {collection['slug']}")
-        if conditions:
 
-            diff = conditions.get('diff_percent_offer_to_floor', 0)
+    def current_configs_items(self) -> list:
+        """(user_id, конфиг) всех пользователей, тот же список, пока конфиги не менялись"""
+        if (
+            self.configs_items is None
+            or self.configs_items_version != self.configs_version
+            or len(self.configs_items) != len(self.configs)
+        ):
+            self.configs_items = list(self.configs.items())
+            self.configs_items_version = self.configs_version
+
+        return self.configs_items
+
 
 
-            # Проверка движения на шаг процентов с прошлого diff процента по percent_step в config
+    def on_config_changed(self, user_id):
+        """Хук BuildConfigs: конфиг пользователя изменен или уведомления снова включены"""
+        # Обращение к defaultdict по индексу подписало бы неизвестного пользователя
+        if (config := self.configs.get(user_id)) is None:
+            return
 
-            if not self.is_diff_step_range_passed(
+        self.configs_version += 1
+        self.blacklist_index.update(user_id, config.blacklist)
+        self.schedule_reevaluation(user_id)
 
-                user_id,
-                collection, 
-                diff,
-                percent_step
 
-            ):
-                return None
 
+    def schedule_reevaluation(self, user_id):
+        self.reevaluate_users.add(user_id)
+        self.reevaluate_event.set()
 
-            if notification_cooldown:
 
-                now = time.time()
-                self.last_notifications[collection['slug']][user_id] = now
 
+    async def wraper_reevaluate(self):
+        """Повторная проверка пользователей по всем коллекциям после смены конфига.
+
+        Идет пачками по batch_size через тот же executor, поэтому пачки обновлений успевают встать между ними,
+        и проверяются только пользователи из reevaluate_users. Кулдауны и шаги процентов сохраняются:
+        уведомления придут только по коллекциям, которые прошли новые фильтры и не были недавно отправлены.
+        """
+        loop = asyncio.get_running_loop()
+
+        while True:
+            await self.reevaluate_event.wait()
+            await asyncio.sleep(self.REEVALUATE_DELAY)
+
+            self.reevaluate_event.clear()
+            user_ids, self.reevaluate_users = list(self.reevaluate_users), set()
 
-            if percent_step: 
-                self.last_diffs[collection['slug']][user_id] = diff
+            configs_items = [(user_id, self.configs[user_id]) for user_id in user_ids if user_id in self.configs]
+            if not configs_items:
+                continue
+
+            if self.pool:
+                self.pool.stage_configs(self.configs)
+
+            collections = list(self.slugs_data.values())
+
+            try:
+                for start in range(0, len(collections), self.batch_size):
+                    batch = [collection.snapshot() for collection in collections[start:start + self.batch_size]]
+                    window_changes = self.price_history.window_changes(batch)
+
+                    notifications = await loop.run_in_executor(
+                        self.executor, self.check_batch_for_notifications, batch, configs_items, window_changes, user_ids
+                    )
+
+                    for user_id, slug, notification in notifications:
+                        await self.notification_managers.add_message(user_id, notification, key=slug)
+
+            except Exception as e:
+                logger.error(f"Ошибка при повторной проверке {user_ids}: {e}")
+                continue
+
+            self.batch_stats["reevaluations"] += 1
+            self.batch_stats["reevaluated_users"] += len(configs_items)
+
+            logger.debug(f"Reevaluated {len(configs_items)} users against {len(collections)} collections")
+
+
+
+    def evaluate_batch(self, collections, configs_items, window_changes=None):
+        """Проверка пачки в потоке воркера с замером времени"""
+        started = time.perf_counter()
+
+        self.cooldowns.expire(time.time())
+        notifications = self.check_batch_for_notifications(collections, configs_items, window_changes)
+
+        duration = time.perf_counter() - started
+
+        stats = self.batch_stats
+        stats["batches"] += 1
+        stats["collections"] += len(collections)
+        stats["notifications"] += len(notifications)
+        stats["last_duration"] = duration
+        stats["total_duration"] += duration
+        stats["max_duration"] = max(stats["max_duration"], duration)
+
+        Metrics.evaluation.observe(duration)
+
+        logger.debug(f"Batch: {len(collections)} collections x {len(configs_items)} users -> {len(notifications)} notifications in {duration * 1000:.1f} ms, {self.notification_queue.qsize()} pending")
+
+        return notifications
+
+
+
+    def check_batch_for_notifications(self, collections, configs_items, window_changes=None, user_ids=None):
+        """Проверка пачки коллекций по настройкам пользователей configs_items, в пуле процессов - user_ids или всех"""
+
+        if not BatchEvaluator.is_available():
+            window_rows = list(zip(*window_changes)) if window_changes else [None] * len(collections)
+
+            # Исключившие slug пользователи пропускаются до кулдауна и остальных фильтров
+            return [
+                (user_id, collection.slug, notification)
+                for collection, window_change in zip(collections, window_rows)
+                for blocked in (self.blacklist_index.blocked_users(collection.slug),)
+                for user_id, config in configs_items
+                if user_id not in blocked
+                and (notification := self.check_for_notifications(collection, user_id, config, window_change))
+            ]
+
+        notifications = []
+
+        if not (collections and configs_items):
+            return notifications
+
+        columns = CollectionColumns(collections, self.volume_rank, self.scraper.full_scanned, window_changes)
+
+        if self.pool:
+            now = time.time()
+            selected = self.pool.evaluate(columns, now, user_ids, self.cooldowns)
+
+            # cooldowns - копия кулдаунов воркеров: по ней проверяются пользователи упавшего воркера,
+            # и она же загружается в перезапущенный воркер
+            for row, user_id, diff, _ in selected:
+                if (config := self.configs.get(user_id)) is not None:
+                    self.cooldowns.record(collections[row].slug, user_id, now, config.notification_cooldown or 0, diff, config.percent_step or 0)
+
+            # Пользователи перезапущенных воркеров проверяются в потоке, пока воркер не получит конфиги
+            if self.pool.restoring:
+                restoring = [(user_id, config) for user_id, config in configs_items if self.pool.is_restoring(user_id)]
+                if restoring:
+                    selected += BatchEvaluator.select(columns, UserColumns(restoring, self.blacklist_index), self.cooldowns, now)
+        else:
+            selected = BatchEvaluator.select(columns, self.columns_for(configs_items, user_ids), self.cooldowns, time.time())
+
+        for row, user_id, diff, windowed in selected:
+            collection = collections[row]
+            notifications.append((user_id, collection.slug, self.build_notification(collection, windowed)))
+
+        return notifications
+
+
+
+    def columns_for(self, configs_items: list, user_ids=None) -> UserColumns:
+        """Колонки пользователей: для общего списка из current_configs_items - из кэша, пока список тот же"""
+        if user_ids is not None:
+            return UserColumns(configs_items, self.blacklist_index)
+
+        # Ключ - сам список: новый список появляется только после изменения конфигов
+        if self.user_columns is None or self.user_columns[0] is not configs_items:
+            self.user_columns = (configs_items, UserColumns(configs_items, self.blacklist_index))
+
+        return self.user_columns[1]
+
+
+
+    def register_notification(self, collection, user_id, diff, notification_cooldown, percent_step, windowed=None):
+        """Проверка шага разницы, запоминание состояния и создание уведомления"""
+
+        # Проверка движения на шаг процентов с прошлого diff процента по percent_step в config
+
+        if not self.is_diff_step_range_passed(
+
+            user_id,
+            collection, 
+            diff,
+            percent_step
+
+        ):
+            return None
+
+
+        self.cooldowns.record(collection.slug, user_id, time.time(), notification_cooldown, diff, percent_step)
+
+
+        return self.build_notification(collection, windowed)
+
+
+
+    def check_for_notifications(self, collection, user_id, config, window_change=None):
+        """Проверка условий и отправка уведомлений"""
+    
+        # logger.debug(f"Checking conditions for {user_id} on collection {collection.slug}")
+        notification_cooldown = config.notification_cooldown or 0
+        percent_step = config.percent_step or 0
+
+
+        # Проверка кулдауна с последнего уведомления по notification_cooldown в config
+        if not self.is_notification_cooldown_passed(collection, user_id, notification_cooldown):
+            return None
+
+
+        conditions = self.custom_condition(collection, user_id, window_change)
+
+        
+        # logger.debug(f"{conditions} Проверка условий для {user_id} по коллекции {collection.slug}")
+        if conditions:
 
+            diff = collection.diff_percent
+            windowed = {key: conditions[key] for key in ('floor_drop', 'offer_rise') if key in conditions}
 
-            notification = self.build_notification(collection, diff)
+            return self.register_notification(collection, user_id, diff, notification_cooldown, percent_step, windowed)
 
-            return notification
@@ -9,12 +9,18 @@ logging.getLogger('aiogram').setLevel(logging.CRITICAL)
 logging.getLogger('urllib3').setLevel(logging.CRITICAL)
 logger = logging.getLogger(__name__)
 
-import asyncio, aiohttp, json
+import asyncio, aiohttp, json, pathlib
 from collections import defaultdict
 
 from OpenSea.notify import NotifyCreator
 from OpenSea.opensea_websocket import OpenSea_WebSocket
 from OpenSea.opensea_toplist_scanner import OpenSea_TopListScanner
+from OpenSea.volume_rank import VolumeRankIndex
+from OpenSea.price_history import PriceHistoryStore
+from OpenSea.coalescing_buffer import CoalescingBuffer
+from OpenSea.snapshot import StateSnapshot
+from OpenSea.capture import CaptureWriter
+from metrics import Metrics
 
 from configs import BuildConfigs
 
@@ -23,7 +29,7 @@ from configs import BuildConfigs
 class BaseNotificationManager:
     
     @staticmethod
-    async def add_message(self, user_id, message):
+    async def add_message(self, user_id, message, key=None):
         print(user_id, message)
 
 
@@ -31,19 +37,44 @@ class OpenSea_Scraper:
     def __init__(
             self,
             session: aiohttp.ClientSession,
-            notification_managers
+            notification_managers,
+            query_mode: str = "full",
+            scan_mode: str = "sequential",
+            ws_connections: int = 1,
+            ws_priority_top: int = 0,
+            subscription_ttl: float = 3600,
+            notification_buffer_size: int = 10_000,
+            notification_overload_policy: str = "drop_oldest",
+            snapshot_path: pathlib.Path = pathlib.Path(__file__).parent / "state.snapshot",
+            capture_path: pathlib.Path = None,
+            evaluation_processes: int = 0,
+            evaluate: bool = True
         ):
         self.session = session
+        self.query_mode = query_mode # full - запросы как на сайте, lean - только поля для NotifyCreator
+        self.scan_mode = scan_mode   # sequential - один курсор через cloudscraper, sharded - шарды параллельно через aiohttp
+        self.ws_connections = ws_connections   # количество WebSocket подключений, коллекции делятся по хэшу slug
+        self.ws_priority_top = ws_priority_top # топ N по 1d объему на отдельном подключении, 0 - выключено
+        self.subscription_ttl = subscription_ttl # секунд вне топ листа до отписки, 0 - не отписываться
         self.queue = asyncio.Queue()
-        self.notification_queue = asyncio.Queue()
+        self.notification_queue = CoalescingBuffer(notification_buffer_size, notification_overload_policy)
         self.notification_managers = notification_managers
 
         self.slugs_data = {}
+        self.volume_rank = VolumeRankIndex()
+        self.price_history = PriceHistoryStore()
 
         self.last_notifications = {}
         self.last_diffs = {}
         self.full_scanned = False
 
+        self.snapshot_path = snapshot_path # None - без снимка состояния
+        self.capture_path = capture_path   # gzip JSONL для replay, None - без записи
+        self.capture = None
+
+        self.evaluation_processes = evaluation_processes # процессов проверки уведомлений, 0 - один поток executor
+        self.evaluate = evaluate # False - notification_queue забирает UpdateForwarder для отдельной роли evaluate
+
         self.configs = BuildConfigs.opensea
 
 
@@ -53,13 +84,51 @@ class OpenSea_Scraper:
 
         scraper = self
 
-        notify_creator = NotifyCreator(scraper)
+        if self.capture_path:
+            self.capture = CaptureWriter(self.capture_path)
+            logger.info(f"Capture: {self.capture_path}")
+
+        notify_creator = NotifyCreator(scraper) if self.evaluate else None
         top_list_scanner = OpenSea_TopListScanner(scraper)
         opensea_websocket = OpenSea_WebSocket(scraper)
 
-        asyncio.create_task(notify_creator.wraper_check_for_notifications())
+        Metrics.add_gauge("opensea_notification_queue_depth", "Collections waiting in notification_queue", self.notification_queue.qsize)
+        Metrics.add_gauge("opensea_collections", "Collections in slugs_data", lambda: len(self.slugs_data))
+        Metrics.add_gauge("opensea_price_history_bytes", "Price history ring buffers size", self.price_history.memory_usage)
+        if notify_creator and notify_creator.pool:
+            BuildConfigs.add_listener(notify_creator.pool.mark_changed)
+            Metrics.add_stats("opensea_evaluation_pool", notify_creator.pool.stats, "Notification process pool stats")
+        elif notify_creator:
+            Metrics.add_gauge("opensea_cooldown_entries", "Cooldown and percent step entries", lambda: len(notify_creator.cooldowns))
+            Metrics.add_gauge("opensea_cooldown_bytes", "Cooldown store size", lambda: notify_creator.cooldowns.memory_usage())
+        Metrics.add_stats("opensea_notification_queue", self.notification_queue.stats, "notification_queue stats")
+        Metrics.add_stats("opensea_scan", top_list_scanner.scan_stats, "Top list scan stats")
+        Metrics.add_stats("opensea_traffic", top_list_scanner.traffic_stats, "Top list traffic")
+        if notify_creator:
+            Metrics.add_stats("opensea_batch", notify_creator.batch_stats, "Notification batch stats")
+        Metrics.add_collector(opensea_websocket.collect_metrics)
+
+        snapshot = None
+        if self.snapshot_path:
+            snapshot = StateSnapshot(scraper, notify_creator, self.snapshot_path)
+            snapshot.load()
+            asyncio.create_task(snapshot.run_periodic())
+
+        if notify_creator:
+            BuildConfigs.add_listener(notify_creator.on_config_changed)
+            asyncio.create_task(notify_creator.wraper_check_for_notifications())
+            asyncio.create_task(notify_creator.wraper_reevaluate())
         asyncio.create_task(top_list_scanner.start())
-        await opensea_websocket.run_websocket()
+
+        try:
+            await opensea_websocket.run_websocket()
+        finally:
+            if snapshot:
+                snapshot.save_sync()
+            if self.capture:
+                self.capture.close()
+            if notify_creator and notify_creator.pool:
+                notify_creator.pool.close()
 
 
 def filter_collections():
@@ -7,14 +7,37 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-import asyncio, aiofiles
+import asyncio, aiofiles, json, time
 import cloudscraper
 import pathlib
 
+from OpenSea.collection_record import CollectionRecord
 from requests.exceptions import JSONDecodeError
+from metrics import Metrics
 
 
 class OpenSea_TopListScanner:
+    QUERY_FILES = {
+        "full": "get_top_list.graphql",
+        "lean": "get_top_list_lean.graphql",
+    }
+
+    GRAPHQL_URL = 'https://gql.opensea.io/graphql'
+
+    # Шарды для scan_mode="sharded": полосы 1d объема в USD, у каждого своя цепочка курсоров.
+    # Первая полоса без нижней границы, последняя без верхней, вместе они покрывают весь список без пересечений,
+    # кроме коллекций ровно на границе - повторы убираются при объединении
+    # volumeRange - поле TopCollectionsFilter вида {"min", "max"}, как floorPriceRange
+    SHARDS = [
+        {"filter": {"volumeRange": {"max": 1_000}}},
+        {"filter": {"volumeRange": {"min": 1_000, "max": 10_000}}},
+        {"filter": {"volumeRange": {"min": 10_000, "max": 100_000}}},
+        {"filter": {"volumeRange": {"min": 100_000, "max": 1_000_000}}},
+        {"filter": {"volumeRange": {"min": 1_000_000}}},
+    ]
+    SHARDS_CONCURRENCY = 4
+    SHARD_TIMEOUT = 60 # seconds
+
     def __init__(
             self,
             scraper
@@ -22,14 +45,30 @@ class OpenSea_TopListScanner:
         self.scraper = scraper
         self.queue = scraper.queue
         self.slugs_data = scraper.slugs_data
+        self.volume_rank = scraper.volume_rank
+        self.price_history = scraper.price_history
+        self.capture = scraper.capture
 
         self.notification_queue = scraper.notification_queue
 
+        self.scan_stats = {
+            "scans": 0,
+            "scanned": 0,
+            "changed": 0,
+            "enqueued": 0,
+            "incomplete": 0,
+        }
+
+        self.traffic_stats = {
+            "pages": 0,
+            "bytes": 0,
+        }
+
         self.file_dir = pathlib.Path(__file__).parent
 
 
     async def init(self):
-        graphql_file = self.file_dir / "GraphQL" / "get_top_list.graphql"
+        graphql_file = self.file_dir / "GraphQL" / self.QUERY_FILES[self.scraper.query_mode]
         async with aiofiles.open(graphql_file, "r") as f:
             self.GET_TOP_LIST_QUERY = await f.read()
     
@@ -51,17 +90,38 @@ class OpenSea_TopListScanner:
 
         while True:
             temp_slugs_data = {}
+            complete = False
             try:
-                temp_slugs_data = await asyncio.wait_for(
-                    asyncio.get_event_loop().run_in_executor(None, self.get_all_collections), 
-                    timeout=60  # секунд
-                )
+                started = time.perf_counter()
+
+                if self.scraper.scan_mode == "sharded":
+                    # Таймаут у каждого шарда свой, готовые шарды объединяются и без опоздавших
+                    temp_slugs_data, complete = await self.get_all_collections_sharded()
+                else:
+                    # Поток опоздавшего скана продолжит писать в свой pages, но в capture они уже не попадут
+                    pages = []
+                    temp_slugs_data = await asyncio.wait_for(
+                        asyncio.get_event_loop().run_in_executor(None, self.get_all_collections, pages),
+                        timeout=60  # секунд
+                    )
+                    complete = True
+
+                    if self.capture:
+                        for body in pages:
+                            self.capture.write("page", body)
+
                 logger.debug(f"Получено {len(temp_slugs_data)} коллекций")
+                Metrics.scan.observe(time.perf_counter() - started)
                 
                 retry_delay = 1
 
             except Exception as e:
-                logger.error(f"Ошибка при получении коллекций: {e}")
+                logger.error(f"Ошибка при получении коллекций: {e!r}")
+
+                # replay отбрасывает страницы, записанные до этой отметки
+                if self.capture:
+                    self.capture.write("scan", "failed")
+
                 await asyncio.sleep(retry_delay)
 
                 retry_delay = min(retry_delay * 2, 60)
@@ -71,26 +131,70 @@ class OpenSea_TopListScanner:
                 continue
 
 
-            self.slugs_data.update(temp_slugs_data)
+            if self.capture:
+                self.capture.write("scan", None if complete else "partial")
+
+            to_notify = self.merge_scan(temp_slugs_data)
 
             await self.queue.put(set(temp_slugs_data.keys()))
 
-            if not self.scraper.full_scanned:
+            # Места в рейтинге считаются по полному списку, частичный скан только обновляет цены
+            if complete and not self.scraper.full_scanned:
                 self.scraper.full_scanned = True
 
-            for collection in temp_slugs_data.values():
-                await self.notification_queue.put(collection)
+            for record in to_notify:
+                await self.notification_queue.put(record)
 
             await asyncio.sleep(60)
         
 
-    def get_all_collections(self) -> dict:
-        """Собирает данные всех коллекций с OpenSea"""
+    def merge_scan(self, temp_slugs_data: dict) -> list:
+        """Обновляет slugs_data результатами скана и возвращает только коллекции с изменившимися полями для уведомлений"""
 
-        temp_slugs_data = {}
-        next_page = None
+        to_notify = []
+        changed = 0
+
+        for slug, new_record in temp_slugs_data.items():
+
+            if record := self.slugs_data.get(slug):
+
+                if not record.differs(new_record):
+                    continue
+
+                changed += 1
+                alert_changed = record.differs(new_record, record.ALERT_FIELDS)
+                price_changed = record.merge(new_record)
+
+            else:
+                changed += 1
+                alert_changed = price_changed = True
+                self.slugs_data[slug] = record = new_record
+
+            self.volume_rank.update(slug, record.volume_1d_usd)
+
+            if price_changed:
+                self.price_history.record(record)
+
+            if alert_changed:
+                to_notify.append(record)
+
+
+        stats = self.scan_stats
+        stats["scans"] += 1
+        stats["scanned"] += len(temp_slugs_data)
+        stats["changed"] += changed
+        stats["enqueued"] += len(to_notify)
 
+        logger.debug(f"Скан: {len(temp_slugs_data)} коллекций, изменилось {changed}, в очередь {len(to_notify)}")
 
+        if pages := self.traffic_stats["pages"]:
+            logger.debug(f"Запрос {self.scraper.query_mode}: {self.traffic_stats['bytes'] / pages:.0f} байт на страницу")
+
+        return to_notify
+
+
+
+    def build_variables(self, **overrides) -> dict:
         variables = {
             "filter":{
                 # "floorPriceRange"   : {"min": 0.001}, 
@@ -103,6 +207,45 @@ class OpenSea_TopListScanner:
                 "direction":"DESC"
             }
         }
+        variables.update(overrides)
+        return variables
+
+
+
+    def build_request(self, variables: dict) -> dict:
+        return {
+
+            "operationName":"TopStatsTableQuery",
+            "query": self.GET_TOP_LIST_QUERY,
+            "variables": variables
+
+        }
+
+
+
+    def parse_page(self, response: dict, temp_slugs_data: dict):
+        """Добавляет коллекции страницы в temp_slugs_data и возвращает курсор следующей страницы"""
+
+        top_collections = response["data"]["topCollections"]
+
+        if not top_collections:
+            return None
+
+        for item in top_collections["items"]:
+            temp_slugs_data[item['slug']] = CollectionRecord.from_graphql(item)
+
+        return top_collections["nextPageCursor"]
+
+
+
+    def get_all_collections(self, pages: list = None) -> dict:
+        """Собирает данные всех коллекций с OpenSea, тела страниц добавляются в pages для capture"""
+
+        temp_slugs_data = {}
+        next_page = None
+
+
+        variables = self.build_variables()
 
         with cloudscraper.create_scraper() as scraper:
 
@@ -113,23 +256,17 @@ class OpenSea_TopListScanner:
                     if next_page:
                         variables["cursor"] = next_page
 
-                    response = scraper.post('https://gql.opensea.io/graphql', json={
-
-                        "operationName":"TopStatsTableQuery",
-                        "query": self.GET_TOP_LIST_QUERY,
-                        "variables": variables
-                    
-                    }).json()
+                    response = scraper.post(self.GRAPHQL_URL, json=self.build_request(variables))
 
-                    top_collections = response["data"]["topCollections"]
-                    
-                    if top_collections:
+                    self.traffic_stats["pages"] += 1
+                    self.traffic_stats["bytes"] += len(response.content)
 
+                    if pages is not None:
+                        pages.append(response.text)
 
-                        for item in top_collections["items"]:
-                            temp_slugs_data[item['slug']] = item
+                    response = response.json()
 
-                        next_page = top_collections["nextPageCursor"]
+                    next_page = self.parse_page(response, temp_slugs_data)
 
 
                     if not next_page:
@@ -137,6 +274,82 @@ class OpenSea_TopListScanner:
                 except Exception as e:
                     logger.error(f"Error fetching collections: {e} {response}")
                     raise e
-        
-            
 
+
+
+    async def get_all_collections_sharded(self) -> tuple[dict, bool]:
+        """Собирает коллекции всех шардов параллельно через aiohttp и объединяет в один снимок.
+
+        Возвращает снимок и признак полного покрытия: список покрыт целиком, только если прошли все шарды.
+        """
+
+        semaphore = asyncio.Semaphore(self.SHARDS_CONCURRENCY)
+
+        shards = await asyncio.gather(*(
+            self.get_shard_collections(shard, semaphore)
+            for shard in self.SHARDS
+        ), return_exceptions=True)
+
+        temp_slugs_data = {}
+
+        for shard, shard_slugs_data in zip(self.SHARDS, shards):
+            if isinstance(shard_slugs_data, BaseException):
+                logger.warning(f"Шард {shard['filter']} не получен: {shard_slugs_data!r}")
+                continue
+
+            temp_slugs_data.update(shard_slugs_data)
+
+        errors = [error for error in shards if isinstance(error, BaseException)]
+        if errors and not temp_slugs_data:
+            raise errors[0]
+
+        complete = not errors
+
+        if not complete:
+            self.scan_stats["incomplete"] += 1
+
+        return temp_slugs_data, complete
+
+
+
+    async def get_shard_collections(self, shard: dict, semaphore: asyncio.Semaphore) -> dict:
+        """Проходит цепочку курсоров одного шарда не дольше SHARD_TIMEOUT.
+
+        Страницы пишутся в capture только после успеха шарда, чтобы replay объединял те же данные, что и live.
+        """
+
+        pages = []
+        temp_slugs_data = await asyncio.wait_for(self.walk_shard(shard, semaphore, pages), timeout=self.SHARD_TIMEOUT)
+
+        if self.capture:
+            for body in pages:
+                self.capture.write("page", body)
+
+        return temp_slugs_data
+
+
+
+    async def walk_shard(self, shard: dict, semaphore: asyncio.Semaphore, pages: list) -> dict:
+        temp_slugs_data = {}
+        variables = self.build_variables(**shard)
+
+        while True:
+
+            async with semaphore:
+                async with self.scraper.session.post(self.GRAPHQL_URL, json=self.build_request(variables)) as response:
+                    body = await response.read()
+
+            self.traffic_stats["pages"] += 1
+            self.traffic_stats["bytes"] += len(body)
+            pages.append(body)
+
+            try:
+                next_page = self.parse_page(json.loads(body), temp_slugs_data)
+            except Exception as e:
+                logger.error(f"Error fetching shard {shard}: {e} {body[:200]}")
+                raise e
+
+            if not next_page:
+                return temp_slugs_data
+
+            variables["cursor"] = next_page
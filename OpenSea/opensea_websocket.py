@@ -1,221 +1,515 @@
-
 import logging
 logging.basicConfig(
-    level=logging.DEBUG, 
+    level=logging.DEBUG,
     format="%(asctime)s:%(levelname)s:%(funcName)s: %(message)s",
     datefmt="%H:%M:%S"
 )
 logger = logging.getLogger(__name__)
-import asyncio, aiohttp, aiofiles, json, uuid, pathlib
-from OpenSea.utils import get_usd_price, deep_dict_update
+import asyncio, aiohttp, aiofiles, uuid, pathlib, time, zlib
+from OpenSea.collection_record import CollectionRecord
+from OpenSea.frame_decoder import FrameDecoder
+from OpenSea.subscriptions import SubscriptionRegistry, SubscriptionStore
 from aiohttp.client_exceptions import WSServerHandshakeError
+from metrics import Metrics, format_metric
 
 
-class OpenSea_WebSocket:
+class WebSocketConnection:
+    """Одно подключение к WebSocket OpenSea со своими подписками, переподключением и метриками"""
+
+    URL = "wss://os2-wss.prod.privatesea.io/subscriptions"
+
     def __init__(
             self,
-            scraper
+            manager: "OpenSea_WebSocket",
+            name: str
         ):
-        self.session = scraper.session
+        self.manager = manager
+        self.name = name
+
         self.websocket: aiohttp.ClientWebSocketResponse = None
+        self.acked = asyncio.Event()
 
-        self.queue: asyncio.Queue = scraper.queue
-        self.slugs_data = scraper.slugs_data
+        self.slugs: set[str] = set()
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.registry = SubscriptionRegistry()
 
-        self.notification_queue = scraper.notification_queue
-        self.file_dir = pathlib.Path(__file__).parent
+        self.batch_size = 200
+        self.send_interval = 0.2 # секунд между отправками subscribe/complete
 
+        self.reconnect_delay = 1
 
+        self.stats = {
+            "frames": 0,
+            "bytes": 0,
+            "reconnects": 0,
+            "last_frame_at": 0.0,
+            "handle_time": 0.0,
+            "max_handle_time": 0.0,
+        }
 
-    async def init(self):
-        graphql_file = self.file_dir / "GraphQL" / "subscribe_query.graphql"
-        async with aiofiles.open(graphql_file, "r") as f:
-            self.SUBSCRIBE_QUERY = await f.read()
 
 
+    def add_slugs(self, slugs: set[str]):
+        """Закрепляет коллекции за подключением и ставит их в очередь на подписку"""
+        self.slugs.update(slugs)
+        self.queue.put_nowait(("subscribe", slugs))
 
-    async def load_slugs(self):
-        try:
 
-            async with aiofiles.open(self.file_dir / "collections.json", "r") as f:
-                return set(json.loads(await f.read()))
-        except Exception as e:
-            logger.error(f"Error loading collections: {e}") 
-            return set()
+
+    def remove_slugs(self, slugs: set[str]):
+        """Открепляет коллекции и ставит их в очередь на отписку"""
+        self.slugs.difference_update(slugs)
+        self.queue.put_nowait(("unsubscribe", slugs))
+
+
+
+    def lag(self) -> float:
+        """Сколько секунд подключение не получало сообщений"""
+        if not self.stats["last_frame_at"]:
+            return 0.0
+        return asyncio.get_running_loop().time() - self.stats["last_frame_at"]
+
+
+
+    async def send(self, message: dict):
+        """Отправка с паузой, чтобы не заваливать сервер пачками подписок"""
+        await self.websocket.send_json(message)
+        await asyncio.sleep(self.send_interval)
+
 
 
     async def batch_subscribe(self, to_sub: set[str]):
         """Подписываемся на все коллекции частями"""
-        to_sub: list[str] = list(to_sub)
+        to_sub: list[str] = sorted(to_sub & self.slugs)
 
-        batch_size = 200
+        batch_size = self.batch_size
 
         for i in range(0, len(to_sub), batch_size):
 
 
             if batch := to_sub[i:i+batch_size]:
 
-                asyncio.create_task(
-                    self.websocket.send_json(
-
-                        {
-                            "id": str(uuid.uuid4()), 
-                            "type": "subscribe", 
-                            "payload": {
-                                "query": self.SUBSCRIBE_QUERY,
-                                "operationName": "useCollectionStatsSubscription",
-                                "variables": {
-                                    "slugs": batch
-                                }
+                id = str(uuid.uuid4())
+                self.registry.add(id, set(batch))
+
+                await self.send(
+
+                    {
+                        "id": id,
+                        "type": "subscribe",
+                        "payload": {
+                            "query": self.manager.SUBSCRIBE_QUERY,
+                            "operationName": "useCollectionStatsSubscription",
+                            "variables": {
+                                "slugs": batch
                             }
                         }
+                    }
 
-                    )
                 )
 
+        if to_sub:
+            logger.info(f"[{self.name}] Subscribed to {len(to_sub)} collections.")
 
-    async def save_collections(self, subs: list):
-        try:
-            async with aiofiles.open("collections.json", "w") as f:
-                await f.write(json.dumps(
-                    list(subs), 
-                    separators=(',', ':')
-                ))
-            logger.info(f"Saved {len(subs)} collections to file.")
-        except:
-            logger.error("Error saving collections to file.")
-    
 
-    
-    async def init_subscriptions_manager(self):
-        
-        collection_manager = asyncio.create_task(self.manage_subscriptions())
-        new_slugs = await self.load_slugs()
 
-        while not self.queue._getters:
-            await asyncio.sleep(0.1)
+    async def batch_unsubscribe(self, to_unsub: set[str]):
+        """Завершает подписки с этими коллекциями и переподписывает оставшиеся в них коллекции"""
+        resubscribe = set()
 
-        
-        await self.queue.put(new_slugs)
-        return collection_manager
+        for id in self.registry.ids_for(to_unsub):
+            subscription = self.registry.remove(id)
+            resubscribe |= subscription.slugs
+
+            await self.send({"id": id, "type": "complete"})
+
+        if resubscribe:
+            logger.info(f"[{self.name}] Unsubscribed from {len(to_unsub & resubscribe)} collections.")
+            await self.batch_subscribe(resubscribe - to_unsub)
 
 
 
     async def manage_subscriptions(self):
-        
-        active_slugs = set()
+        """После connection_ack подписывается на все закрепленные коллекции, затем обрабатывает очередь изменений"""
+
         try:
 
+            await self.acked.wait()
+
+            self.registry.clear()
+            await self.batch_subscribe(set(self.slugs))
+
             while not self.websocket.closed:
-                
-                new_slugs: set[str] = await self.queue.get()
-                
-                if not new_slugs:
-                    logger.warning("No slugs found.")
-                    continue
-                
-                new_subscriptions = new_slugs - active_slugs
-                
-                if not new_subscriptions:
-                    logger.debug("No new slugs to subscribe.")
-                    continue
 
-                active_slugs.update(new_subscriptions)
+                action, slugs = await self.queue.get()
 
-                await self.save_collections(active_slugs)
+                if action == "subscribe":
+                    await self.batch_subscribe(slugs - self.registry.slug_ids.keys())
+                elif action == "unsubscribe":
+                    await self.batch_unsubscribe(slugs)
 
-                await self.batch_subscribe(new_subscriptions)
+        except asyncio.CancelledError:
+            logger.info(f"[{self.name}] Connection manager cancelled.")
 
-                logger.info(f"Subscribed to {len(new_subscriptions)} collections.")
 
-                await asyncio.sleep(1)
 
-        except asyncio.CancelledError:
-            logger.info("Connection manager cancelled.")
+    def count_traffic(self, message: aiohttp.WSMessage):
+        stats = self.stats
+        stats["frames"] += 1
+        stats["bytes"] += len(message.data) if isinstance(message.data, (str, bytes)) else 0
+        stats["last_frame_at"] = asyncio.get_running_loop().time()
 
+        if stats["frames"] % 1000 == 0:
+            logger.debug(f"[{self.name}] Подписка {self.manager.query_mode}: {stats['bytes'] / stats['frames']:.0f} байт на сообщение")
 
 
-    async def manage_prices(self, payload: dict):
-        
-        slugs_data = self.slugs_data
 
-        new_collection = payload["data"]["collectionsBySlugs"]
+    async def handle_message(self, message: aiohttp.WSMessage):
+        self.count_traffic(message)
 
-        if new_collection and (slug := new_collection.get("slug")):
-            
-            old_collection = slugs_data.get(slug)
+        if self.manager.capture and isinstance(message.data, (str, bytes)):
+            self.manager.capture.write("ws", message.data)
 
-            if not old_collection: 
-                slugs_data[slug] = new_collection
-            else:
+        decode_started = time.perf_counter()
+        frame = self.manager.decoder.decode(message.data)
+        Metrics.ws_decode.observe(time.perf_counter() - decode_started)
+        # logger.debug(f"Received WebSocket message: {message.data}")
 
-                old_floorPrice = get_usd_price(old_collection, "floorPrice")
-                new_floorPrice = get_usd_price(new_collection, "floorPrice")
-                old_topOffer   = get_usd_price(old_collection, "topOffer")
-                new_topOffer   = get_usd_price(new_collection, "topOffer")
-                
-                if old_floorPrice == new_floorPrice \
-                    and old_topOffer == new_topOffer:
-                        return
 
-                deep_dict_update(old_collection, new_collection)
+        if frame.type == "connection_ack":
+            logger.info(f"[{self.name}] WebSocket connection established.")
+            self.acked.set()
+            return
 
-            # logger.debug(f"{id} \n\n Slug: {slug}\n Floor Price: {new_floorPrice} USD, Top Offer: {new_topOffer} USD\n{'-'*70}")
 
-            await self.notification_queue.put(slugs_data[slug])
+        if frame.type == "next":
+            self.registry.on_next(frame.id)
 
+            if frame.record:
+                await self.manager.manage_prices(frame.record)
 
+        elif frame.type == "error":
+            self.registry.on_error(frame.id, frame.payload)
 
-    async def run_websocket(self):
-        """Подключается к WebSocket OpenSea и отслеживает изменения в коллекциях"""
+        elif frame.type == "complete":
+            if subscription := self.registry.on_complete(frame.id):
+                self.queue.put_nowait(("subscribe", subscription.slugs))
 
-        await self.init()
+        else:
+            logger.warning(f"[{self.name}] Received unexpected message: {message.data}")
 
-        reconnect_delay = 1
 
-        while True:
-            
-            if not self.session: continue
-            
-            try:
 
-                async with self.session.ws_connect(f"wss://os2-wss.prod.privatesea.io/subscriptions", heartbeat=30) as websocket:
-                    self.websocket = websocket
-                    
-                    reconnect_delay = 1
+    async def run(self):
+        """Подключается к WebSocket OpenSea и переподключается с собственной задержкой"""
 
-                    await websocket.send_json({"type": "connection_init"})
+        loop = asyncio.get_running_loop()
 
+        while True:
+
+            try:
 
-                    collection_manager = await self.init_subscriptions_manager()
+                async with self.manager.session.ws_connect(self.URL, heartbeat=30) as websocket:
+                    self.websocket = websocket
+                    self.acked.clear()
 
+                    self.reconnect_delay = 1
 
-                    async for message in websocket:
-                        message_data = message.json()
-                        # logger.debug(f"Received WebSocket message: {message_data}")
+                    await websocket.send_json({"type": "connection_init"})
 
 
-                        if message_data.get("type") == "connection_ack":
-                            logger.info("WebSocket connection established.")
-                            continue
+                    collection_manager = asyncio.create_task(self.manage_subscriptions())
 
+                    try:
+                        async for message in websocket:
+                            started = loop.time()
 
-                        if payload := message_data.get("payload"):
-                            await self.manage_prices(payload)
-                        else:
-                            logger.warning(f"Received unexpected message: {message.data}")
+                            await self.handle_message(message)
 
+                            handle_time = loop.time() - started
+                            self.stats["handle_time"] += handle_time
+                            self.stats["max_handle_time"] = max(self.stats["max_handle_time"], handle_time)
 
-                    else:
+                    finally:
                         collection_manager.cancel()
                         await collection_manager
-                        logger.info(f"WebSocket connection closed. {message.type}")
+
+                    logger.info(f"[{self.name}] WebSocket connection closed. {websocket.close_code}")
 
             except WSServerHandshakeError as e:
-                logger.error(f"WebSocket connection failed: {e}\nRetrying in {reconnect_delay} seconds...")
-                await asyncio.sleep(reconnect_delay)
-                reconnect_delay = min(reconnect_delay * 2, 60)
+                logger.error(f"[{self.name}] WebSocket connection failed: {e}\nRetrying in {self.reconnect_delay} seconds...")
             except Exception as e:
-                logger.error(f"Error in WebSocket connection: {e}\nRetrying in {reconnect_delay} seconds...")
-                await asyncio.sleep(reconnect_delay)
-                reconnect_delay = min(reconnect_delay * 2, 60)
\ No newline at end of file
+                logger.error(f"[{self.name}] Error in WebSocket connection: {e}\nRetrying in {self.reconnect_delay} seconds...")
+
+            self.stats["reconnects"] += 1
+            await asyncio.sleep(self.reconnect_delay)
+            self.reconnect_delay = min(self.reconnect_delay * 2, 60)
+
+
+
+class OpenSea_WebSocket:
+    """Распределяет коллекции по нескольким подключениям по стабильному хэшу slug"""
+
+    QUERY_FILES = {
+        "full": "subscribe_query.graphql",
+        "lean": "subscribe_query_lean.graphql",
+    }
+
+    def __init__(
+            self,
+            scraper
+        ):
+        self.scraper = scraper
+        self.session = scraper.session
+        self.query_mode = scraper.query_mode
+        self.decoder = FrameDecoder()
+        self.capture = scraper.capture
+
+        self.queue: asyncio.Queue = scraper.queue
+        self.slugs_data = scraper.slugs_data
+        self.volume_rank = scraper.volume_rank
+        self.price_history = scraper.price_history
+
+        self.notification_queue = scraper.notification_queue
+
+        # Отдельное подключение для топ N коллекций по 1d объему, 0 - без него
+        self.priority_top = scraper.ws_priority_top
+        self.priority_connection = WebSocketConnection(self, "priority") if self.priority_top else None
+
+        self.connections = [
+            WebSocketConnection(self, f"shard-{index}")
+            for index in range(max(1, scraper.ws_connections))
+        ]
+
+        self.assignments: dict[str, WebSocketConnection] = {}
+
+        # Коллекции, которых нет в топ листе дольше subscription_ttl секунд, отписываются
+        self.subscription_ttl = scraper.subscription_ttl
+        self.last_seen: dict[str, float] = {}
+
+        self.file_dir = pathlib.Path(__file__).parent
+        self.store = SubscriptionStore(self.file_dir)
+
+
+
+    @property
+    def all_connections(self) -> list[WebSocketConnection]:
+        return ([self.priority_connection] if self.priority_connection else []) + self.connections
+
+
+
+    async def init(self):
+        logger.info(f"WebSocket decoder: {self.decoder.backend}, connections: {len(self.all_connections)}")
+        graphql_file = self.file_dir / "GraphQL" / self.QUERY_FILES[self.query_mode]
+        async with aiofiles.open(graphql_file, "r") as f:
+            self.SUBSCRIBE_QUERY = await f.read()
+
+
+
+    def choose_connection(self, slug: str) -> WebSocketConnection:
+        if self.priority_connection and self.volume_rank.is_top_N(slug, self.priority_top):
+            return self.priority_connection
+
+        return self.connections[zlib.crc32(slug.encode()) % len(self.connections)]
+
+
+
+    def assign_slugs(self, slugs: set[str]) -> set[str]:
+        """Закрепляет новые коллекции за подключениями. Коллекция остается на своем подключении, пока не устареет"""
+
+        grouped: dict[WebSocketConnection, set[str]] = {}
+
+        for slug in slugs:
+            if slug in self.assignments:
+                continue
+
+            connection = self.assignments[slug] = self.choose_connection(slug)
+            grouped.setdefault(connection, set()).add(slug)
+
+        for connection, connection_slugs in grouped.items():
+            connection.add_slugs(connection_slugs)
+
+        return set().union(*grouped.values())
+
+
+
+    def rebalance_priority(self) -> int:
+        """Переносит коллекции, которые вошли в топ N или выпали из него, между приоритетным и обычными подключениями.
+
+        Вызывается после скана топ листа: при первом закреплении рейтинга могло еще не быть.
+        Возвращает число перенесенных коллекций.
+        """
+        priority = self.priority_connection
+
+        # Рейтинг по частичному скану неполный, по нему коллекции не переносятся
+        if not priority or not self.scraper.full_scanned:
+            return 0
+
+        top = set(self.volume_rank.top(self.priority_top))
+
+        moves = [
+            slug for slug in top
+            if (connection := self.assignments.get(slug)) is not None and connection is not priority
+        ] + [
+            slug for slug in priority.slugs if slug not in top
+        ]
+
+        removed: dict[WebSocketConnection, set[str]] = {}
+        added: dict[WebSocketConnection, set[str]] = {}
+
+        for slug in moves:
+            old_connection = self.assignments[slug]
+            new_connection = self.assignments[slug] = self.choose_connection(slug)
+
+            removed.setdefault(old_connection, set()).add(slug)
+            added.setdefault(new_connection, set()).add(slug)
+
+        for connection, connection_slugs in removed.items():
+            connection.remove_slugs(connection_slugs)
+        for connection, connection_slugs in added.items():
+            connection.add_slugs(connection_slugs)
+
+        return len(moves)
+
+
+
+    def unassign_slugs(self, slugs: set[str]):
+        grouped: dict[WebSocketConnection, set[str]] = {}
+
+        for slug in slugs:
+            if connection := self.assignments.pop(slug, None):
+                grouped.setdefault(connection, set()).add(slug)
+
+            self.last_seen.pop(slug, None)
+
+        for connection, connection_slugs in grouped.items():
+            connection.remove_slugs(connection_slugs)
+
+
+
+    def expired_slugs(self) -> set[str]:
+        if not self.subscription_ttl:
+            return set()
+
+        deadline = time.time() - self.subscription_ttl
+        return {slug for slug, seen in self.last_seen.items() if seen < deadline}
+
+
+
+    async def manage_subscriptions(self):
+        """Принимает наборы коллекций от сканера топ листа, раздает их подключениям и отписывает устаревшие"""
+
+        slugs = await self.store.load()
+        self.last_seen.update(dict.fromkeys(slugs, time.time()))
+        self.assign_slugs(slugs)
+
+        while True:
+
+            new_slugs: set[str] = await self.queue.get()
+
+            if not new_slugs:
+                logger.warning("No slugs found.")
+                continue
+
+            self.last_seen.update(dict.fromkeys(new_slugs, time.time()))
+
+            added = self.assign_slugs(new_slugs)
+
+            if moved := self.rebalance_priority():
+                logger.info(f"Moved {moved} collections between priority and regular connections.")
+
+            expired = self.expired_slugs()
+            self.unassign_slugs(expired)
+
+            if not (added or expired):
+                logger.debug("No new slugs to subscribe.")
+                continue
+
+            logger.info(f"Collections: +{len(added)} -{len(expired)}, {len(self.assignments)} subscribed.")
+
+            await self.store.update(added, expired)
+
+
+
+    def connection_stats(self) -> dict[str, dict]:
+        return {
+            connection.name: {
+                **connection.stats,
+                **connection.registry.states(),
+                "slugs": len(connection.slugs),
+                "lag": connection.lag(),
+                "connected": bool(connection.websocket and not connection.websocket.closed),
+            }
+            for connection in self.all_connections
+        }
+
+
+
+    def collect_metrics(self) -> list[str]:
+        """Статистика подключений для Prometheus, по gauge на поле с меткой connection"""
+        stats = self.connection_stats()
+        keys = {key for connection in stats.values() for key in connection}
+
+        lines = []
+        for key in sorted(keys):
+            lines.extend(format_metric(f"opensea_ws_{key}", "gauge", f"WebSocket connection stats: {key}", [
+                ({"connection": name}, float(connection[key]))
+                for name, connection in stats.items()
+                if key in connection and isinstance(connection[key], (int, float))
+            ]))
+        return lines
+
+
+
+    async def report_stats(self, interval: float = 60):
+        while True:
+            await asyncio.sleep(interval)
+
+            for name, stats in self.connection_stats().items():
+                frames = stats["frames"] or 1
+                logger.debug(
+                    f"[{name}] slugs={stats['slugs']} subscriptions={stats['active']}/{stats['pending']}/{stats['error']} frames={stats['frames']} reconnects={stats['reconnects']} "
+                    f"lag={stats['lag']:.1f}s handle={stats['handle_time'] / frames * 1000:.2f}ms max={stats['max_handle_time'] * 1000:.1f}ms"
+                )
+
+
+
+    async def manage_prices(self, new_record: CollectionRecord):
+        started = time.perf_counter()
+
+        slugs_data = self.slugs_data
+        slug = new_record.slug
+
+        old_record = slugs_data.get(slug)
+
+        if new_record.volume_1d_usd is not None:
+            self.volume_rank.update(slug, new_record.volume_1d_usd)
+
+        if not old_record:
+            slugs_data[slug] = new_record
+        elif not old_record.merge(new_record):
+            return
+
+        self.price_history.record(slugs_data[slug])
+
+        Metrics.merge.observe(time.perf_counter() - started)
+
+        # logger.debug(f"{id} \n\n Slug: {slug}\n Floor Price: {new_record.floor_usd} USD, Top Offer: {new_record.offer_usd} USD\n{'-'*70}")
+
+        await self.notification_queue.put(slugs_data[slug])
+
+
+
+    async def run_websocket(self):
+        """Подключается к WebSocket OpenSea и отслеживает изменения в коллекциях"""
+
+        await self.init()
+
+        while not self.session:
+            await asyncio.sleep(1)
+
+        await asyncio.gather(
+            self.manage_subscriptions(),
+            self.report_stats(),
+            *(connection.run() for connection in self.all_connections)
+        )
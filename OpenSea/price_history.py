@@ -0,0 +1,164 @@
+import math, time
+from array import array
+from collections import deque
+
+
+# Окна для оконных алертов, секунды
+WINDOWS = (60, 300, 900, 3600)
+
+
+def window_index(seconds: int) -> int:
+    """Индекс наименьшего окна, которое покрывает seconds"""
+    for index, window in enumerate(WINDOWS):
+        if seconds <= window:
+            return index
+    return len(WINDOWS) - 1
+
+
+
+class _WindowState:
+    """Монотонные очереди номеров сэмплов одного окна: максимум floor, минимум topOffer и первый сэмпл"""
+
+    __slots__ = ("seconds", "floor_max", "offer_min", "first")
+
+    def __init__(self, seconds: int):
+        self.seconds = seconds
+        self.floor_max: deque[int] = deque()
+        self.offer_min: deque[int] = deque()
+        self.first = 0
+
+
+
+class PriceHistory:
+    """Кольцевой буфер (время, floor USD, topOffer USD) одной коллекции в заранее выделенных массивах"""
+
+    __slots__ = ("capacity", "times", "floor", "offer", "seq", "windows")
+
+    def __init__(self, capacity: int = 128):
+        self.capacity = capacity
+        self.times = array('d', [0.0]) * capacity
+        self.floor = array('d', [math.nan]) * capacity
+        self.offer = array('d', [math.nan]) * capacity
+        self.seq = 0   # номер следующего сэмпла
+        self.windows = tuple(_WindowState(seconds) for seconds in WINDOWS)
+
+
+
+    def append(self, timestamp: float, floor: float, offer: float):
+        capacity = self.capacity
+        seq = self.seq
+        index = seq % capacity
+
+        self.times[index] = timestamp
+        self.floor[index] = math.nan if floor is None else floor
+        self.offer[index] = math.nan if offer is None else offer
+        self.seq = seq + 1
+
+        for window in self.windows:
+
+            if floor is not None:
+                floor_max = window.floor_max
+                while floor_max and self.floor[floor_max[-1] % capacity] <= floor:
+                    floor_max.pop()
+                floor_max.append(seq)
+
+            if offer is not None:
+                offer_min = window.offer_min
+                while offer_min and self.offer[offer_min[-1] % capacity] >= offer:
+                    offer_min.pop()
+                offer_min.append(seq)
+
+            self.evict(window, timestamp)
+
+
+
+    def evict(self, window: _WindowState, now: float):
+        """Убирает сэмплы старше окна и перезаписанные в кольце.
+
+        Сэмплы пишутся только при изменении цены, поэтому последний сэмпл до начала окна остается:
+        это цена, которая действовала на начало окна.
+        """
+        capacity = self.capacity
+        cutoff = now - window.seconds
+
+        first = max(window.first, self.seq - capacity, 0)
+        while first + 1 < self.seq and self.times[(first + 1) % capacity] <= cutoff:
+            first += 1
+        window.first = first
+
+        for queue in (window.floor_max, window.offer_min):
+            while queue and queue[0] < first:
+                queue.popleft()
+
+
+
+    def window_values(self, window: _WindowState, now: float) -> tuple:
+        """(первый floor, максимум floor, первый topOffer, минимум topOffer) за окно, NaN если данных нет"""
+        self.evict(window, now)
+        capacity = self.capacity
+
+        if window.first >= self.seq:
+            return math.nan, math.nan, math.nan, math.nan
+
+        first_index = window.first % capacity
+
+        return (
+            self.floor[first_index],
+            self.floor[window.floor_max[0] % capacity] if window.floor_max else math.nan,
+            self.offer[first_index],
+            self.offer[window.offer_min[0] % capacity] if window.offer_min else math.nan,
+        )
+
+
+
+class PriceHistoryStore:
+    """Истории цен всех коллекций. Пишется и читается только из потока event loop"""
+
+    def __init__(self, capacity: int = 128):
+        self.capacity = capacity
+        self.histories: dict[str, PriceHistory] = {}
+
+
+
+    def record(self, record, timestamp: float = None):
+        if (history := self.histories.get(record.slug)) is None:
+            history = self.histories[record.slug] = PriceHistory(self.capacity)
+
+        history.append(timestamp or time.time(), record.floor_usd, record.offer_usd)
+
+
+
+    def window_changes(self, collections: list, now: float = None) -> tuple[list, list]:
+        """Для каждой коллекции и окна: падение floor от максимума и рост topOffer от минимума в процентах"""
+        now = now or time.time()
+        nan = math.nan
+
+        floor_drops = []
+        offer_rises = []
+
+        for collection in collections:
+            history = self.histories.get(collection.slug)
+
+            if history is None or not collection.floor_usd or not collection.offer_usd:
+                floor_drops.append([nan] * len(WINDOWS))
+                offer_rises.append([nan] * len(WINDOWS))
+                continue
+
+            floor_drop = []
+            offer_rise = []
+
+            for window in history.windows:
+                _, floor_max, _, offer_min = history.window_values(window, now)
+
+                floor_drop.append((floor_max - collection.floor_usd) / floor_max * 100 if floor_max else nan)
+                offer_rise.append((collection.offer_usd - offer_min) / offer_min * 100 if offer_min else nan)
+
+            floor_drops.append(floor_drop)
+            offer_rises.append(offer_rise)
+
+        return floor_drops, offer_rises
+
+
+
+    def memory_usage(self) -> int:
+        return len(self.histories) * self.capacity * 3 * 8
@@ -0,0 +1,197 @@
+import logging
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s:%(levelname)s:%(funcName)s: %(message)s",
+    datefmt="%H:%M:%S"
+)
+logger = logging.getLogger(__name__)
+
+import asyncio, pathlib
+
+from OpenSea.collection_record import CollectionRecord
+from OpenSea.opensea import OpenSea_Scraper
+from OpenSea.notify import NotifyCreator
+from OpenSea.price_history import WINDOWS
+from transport import TransportClient, TransportServer
+from metrics import Metrics
+
+from configs import BuildConfigs
+
+
+# Запись обновления: поля CollectionRecord, место в рейтинге 1d объема, падение floor и рост topOffer по окнам
+def encode_update(record: CollectionRecord, rank, floor_drop: list, offer_rise: list) -> list:
+    return [getattr(record, field) for field in CollectionRecord.FIELDS] + [rank, floor_drop, offer_rise]
+
+
+def decode_update(row: list) -> tuple:
+    fields = len(CollectionRecord.FIELDS)
+    return CollectionRecord(*row[:fields]), row[fields], row[fields + 1], row[fields + 2]
+
+
+
+class UpdateForwarder:
+    """Роль ingest: забирает пачки из notification_queue и отправляет их роли evaluate вместо локального NotifyCreator"""
+
+    def __init__(self, scraper, client: TransportClient, batch_size: int = 1000):
+        self.scraper = scraper
+        self.client = client
+        self.batch_size = batch_size
+
+
+
+    async def run(self):
+        scraper = self.scraper
+
+        while True:
+            collections = await scraper.notification_queue.get_batch(self.batch_size)
+            floor_drops, offer_rises = scraper.price_history.window_changes(collections)
+
+            self.client.send("updates", {
+                "full_scanned": scraper.full_scanned,
+                "records": [
+                    encode_update(collection, scraper.volume_rank.rank(collection.slug), floor_drop, offer_rise)
+                    for collection, floor_drop, offer_rise in zip(collections, floor_drops, offer_rises)
+                ],
+            })
+
+
+
+class ReceivedRanks:
+    """Рейтинг 1d объема, посчитанный ролью ingest, вместо VolumeRankIndex"""
+
+    def __init__(self):
+        self.ranks: dict[str, int] = {}
+
+
+
+    def __len__(self):
+        return len(self.ranks)
+
+
+
+    def rank(self, slug: str):
+        return self.ranks.get(slug)
+
+
+
+    def is_top_N(self, slug: str, top_volume) -> bool:
+        if 0 >= top_volume:
+            return False
+
+        rank = self.rank(slug)
+        return rank is not None and rank < top_volume
+
+
+
+class ReceivedWindows:
+    """Оконные изменения цен, посчитанные ролью ingest, вместо PriceHistoryStore"""
+
+    def __init__(self):
+        self.changes: dict[str, tuple[list, list]] = {}
+
+
+
+    def window_changes(self, collections: list, now: float = None) -> tuple[list, list]:
+        nan = [float('nan')] * len(WINDOWS)
+
+        rows = [self.changes.get(collection.slug, (nan, nan)) for collection in collections]
+        return [floor_drop for floor_drop, _ in rows], [offer_rise for _, offer_rise in rows]
+
+
+
+    def memory_usage(self) -> int:
+        return 0
+
+
+
+class AlertForwarder:
+    """notification_managers роли evaluate: готовые уведомления уходят роли deliver"""
+
+    def __init__(self, client: TransportClient):
+        self.client = client
+
+
+
+    async def add_message(self, user_id, message, key=None):
+        self.client.send("alert", [user_id, key, message])
+
+
+
+class RemoteEvaluator:
+    """Роль evaluate: обновления от ingest и конфиги от deliver на своем сокете, уведомления на сокет deliver"""
+
+    def __init__(self, socket_path: pathlib.Path, deliver_path: pathlib.Path, **scraper_options):
+        self.alerts = TransportClient(deliver_path)
+
+        self.scraper = OpenSea_Scraper(session=None, notification_managers=AlertForwarder(self.alerts), snapshot_path=None, **scraper_options)
+        self.scraper.volume_rank = ReceivedRanks()
+        self.scraper.price_history = ReceivedWindows()
+
+        self.notify_creator = NotifyCreator(self.scraper)
+        self.server = TransportServer(socket_path, self.handle)
+
+
+
+    async def handle(self, kind: str, payload):
+        if kind == "updates":
+            await self.handle_updates(payload)
+
+        elif kind == "config":
+            BuildConfigs.apply_configs({int(user_id): config for user_id, config in payload.items()})
+
+        elif kind == "configs":
+            BuildConfigs.apply_configs({int(user_id): config for user_id, config in payload.items()}, only_changed=True)
+
+        else:
+            logger.warning(f"Unknown frame kind: {kind}")
+
+
+
+    async def handle_updates(self, payload: dict):
+        scraper = self.scraper
+        slugs_data = scraper.slugs_data
+        ranks = scraper.volume_rank.ranks
+        changes = scraper.price_history.changes
+
+        scraper.full_scanned = payload["full_scanned"]
+
+        for row in payload["records"]:
+            record, rank, floor_drop, offer_rise = decode_update(row)
+            slug = record.slug
+
+            ranks[slug] = rank
+            changes[slug] = (floor_drop, offer_rise)
+
+            # merge сохраняет version записи, по ней NotifyCreator кэширует текст уведомления
+            if (current := slugs_data.get(slug)) is None:
+                slugs_data[slug] = record
+            else:
+                current.merge(record)
+
+            await scraper.notification_queue.put(slugs_data[slug])
+
+
+
+    async def run(self):
+        notify_creator = self.notify_creator
+
+        Metrics.add_gauge("opensea_notification_queue_depth", "Collections waiting in notification_queue", self.scraper.notification_queue.qsize)
+        Metrics.add_stats("opensea_batch", notify_creator.batch_stats, "Notification batch stats")
+        Metrics.add_stats("transport_updates", self.server.stats, "Received update frames")
+        Metrics.add_stats("transport_alerts", self.alerts.stats, "Sent alert frames")
+
+        if notify_creator.pool:
+            BuildConfigs.add_listener(notify_creator.pool.mark_changed)
+
+        BuildConfigs.add_listener(notify_creator.on_config_changed)
+        asyncio.create_task(notify_creator.wraper_reevaluate())
+
+        self.alerts.start()
+        await self.server.start()
+
+        try:
+            await notify_creator.wraper_check_for_notifications()
+        finally:
+            await self.server.close()
+            if notify_creator.pool:
+                notify_creator.pool.close()
@@ -0,0 +1,214 @@
+import logging
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s:%(levelname)s:%(funcName)s: %(message)s",
+    datefmt="%H:%M:%S"
+)
+logger = logging.getLogger(__name__)
+
+import argparse, asyncio, json, pathlib, time
+
+from OpenSea.opensea import OpenSea_Scraper
+from OpenSea.notify import NotifyCreator
+from OpenSea.opensea_websocket import OpenSea_WebSocket
+from OpenSea.opensea_toplist_scanner import OpenSea_TopListScanner
+from OpenSea.coalescing_buffer import CoalescingBuffer
+from OpenSea.capture import read_capture
+from configs import load_configs
+
+
+class TimedCoalescingBuffer(CoalescingBuffer):
+    """CoalescingBuffer, который помнит время первого обновления каждой ожидающей коллекции"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.first_put: dict[str, float] = {}
+        self.taken: dict[str, float] = {}   # время обновления коллекций текущей пачки
+        self.waiting = False                # NotifyCreator ждет новую пачку при пустом буфере
+
+
+
+    async def put(self, collection):
+        if collection.slug not in self.pending:
+            self.first_put[collection.slug] = time.perf_counter()
+        await super().put(collection)
+
+
+
+    async def get_batch(self, max_items: int) -> list:
+        self.waiting = not self.pending
+        batch = await super().get_batch(max_items)
+        self.waiting = False
+
+        self.taken = {collection.slug: self.first_put.pop(collection.slug, None) for collection in batch}
+        return batch
+
+
+
+class ReplayNotificationManagers:
+    """Заглушка notification_managers: ничего не отправляет, считает уведомления и задержку от обновления до алерта"""
+
+    def __init__(self):
+        self.buffer: TimedCoalescingBuffer = None
+        self.latencies: list[float] = []
+        self.notifications = 0
+
+
+
+    async def add_message(self, user_id, message, key=None):
+        self.notifications += 1
+
+        if (updated_at := self.buffer.taken.get(key)) is not None:
+            self.latencies.append(time.perf_counter() - updated_at)
+
+
+
+class Replay:
+    """Прогоняет лог CaptureWriter через manage_prices, merge_scan и NotifyCreator без сети"""
+
+    def __init__(self, path: pathlib.Path, speed: float = 1, configs_path: pathlib.Path = None, **scraper_options):
+        self.path = pathlib.Path(path)
+        self.speed = speed   # 1 - реальное время, N - в N раз быстрее, 0 - максимально быстро
+
+        self.managers = ReplayNotificationManagers()
+        self.scraper = OpenSea_Scraper(session=None, notification_managers=self.managers, snapshot_path=None, **scraper_options)
+
+        self.buffer = TimedCoalescingBuffer(self.scraper.notification_queue.max_size, self.scraper.notification_queue.overload_policy)
+        self.scraper.notification_queue = self.managers.buffer = self.buffer
+
+        if configs_path:
+            self.scraper.configs = load_configs(configs_path)
+
+        self.notify_creator = NotifyCreator(self.scraper)
+        self.websocket = OpenSea_WebSocket(self.scraper)
+        self.scanner = OpenSea_TopListScanner(self.scraper)
+
+        self.counts = {
+            "ws": 0,
+            "page": 0,
+            "scan": 0,
+            "updates": 0,
+        }
+
+
+
+    async def feed(self):
+        decoder = self.websocket.decoder
+        counts = self.counts
+
+        scan_data = {}
+        first_timestamp = None
+        started = time.perf_counter()
+
+        for timestamp, kind, data in read_capture(self.path):
+
+            if first_timestamp is None:
+                first_timestamp = timestamp
+
+            if self.speed:
+                delay = (timestamp - first_timestamp) / self.speed - (time.perf_counter() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            counts[kind] += 1
+
+            if kind == "ws":
+                frame = decoder.decode(data)
+
+                if frame.type == "next" and frame.record:
+                    counts["updates"] += 1
+                    await self.websocket.manage_prices(frame.record)
+
+            elif kind == "page":
+                self.scanner.parse_page(json.loads(data), scan_data)
+
+            elif kind == "scan" and data == "failed":
+                # Live режим не объединял страницы неудавшегося скана
+                scan_data = {}
+
+            elif kind == "scan":
+                counts["updates"] += len(scan_data)
+
+                to_notify = self.scanner.merge_scan(scan_data)
+                if data != "partial":
+                    self.scraper.full_scanned = True
+
+                for record in to_notify:
+                    await self.buffer.put(record)
+
+                scan_data = {}
+
+            # Как в живом режиме, между сообщениями event loop успевает отдать пачку в NotifyCreator
+            await asyncio.sleep(0)
+
+
+
+    async def run(self) -> dict:
+        notify_task = asyncio.create_task(self.notify_creator.wraper_check_for_notifications())
+
+        started = time.perf_counter()
+        await self.feed()
+
+        while not (self.buffer.empty() and self.buffer.waiting):
+            await asyncio.sleep(0.01)
+
+        duration = time.perf_counter() - started
+
+        notify_task.cancel()
+        self.notify_creator.executor.shutdown()
+        if self.notify_creator.pool:
+            self.notify_creator.pool.close()
+
+        return self.report(duration)
+
+
+
+    def report(self, duration: float) -> dict:
+        latencies = sorted(self.managers.latencies)
+
+        def percentile(p):
+            if not latencies:
+                return float('nan')
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] * 1000
+
+        return {
+            **self.counts,
+            "duration": duration,
+            "updates_per_second": self.counts["updates"] / duration if duration else 0,
+            "notifications": self.managers.notifications,
+            "batches": self.notify_creator.batch_stats["batches"],
+            "coalesced": self.buffer.stats["coalesced"],
+            "dropped": self.buffer.stats["dropped"],
+            "latency_p50_ms": percentile(50),
+            "latency_p90_ms": percentile(90),
+            "latency_p99_ms": percentile(99),
+            "latency_max_ms": latencies[-1] * 1000 if latencies else float('nan'),
+        }
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay OpenSea capture log without network access")
+    parser.add_argument("path", type=pathlib.Path, help="gzip JSONL written with capture_path")
+    parser.add_argument("--speed", type=float, default=1, help="1 - real time, N - N times faster, 0 - as fast as possible")
+    parser.add_argument("--configs", type=pathlib.Path, default=None, help="configs.json with user configs, default - BuildConfigs store OpenSea/configs.sqlite3")
+    parser.add_argument("--buffer-size", type=int, default=10_000)
+    parser.add_argument("--overload-policy", default="drop_oldest")
+    parser.add_argument("--processes", type=int, default=0, help="notification worker processes, 0 - one thread")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.INFO)
+
+    replay = Replay(
+        args.path,
+        speed=args.speed,
+        configs_path=args.configs,
+        notification_buffer_size=args.buffer_size,
+        notification_overload_policy=args.overload_policy,
+        evaluation_processes=args.processes
+    )
+
+    for name, value in asyncio.run(replay.run()).items():
+        print(f"{name:20} {value:.3f}" if isinstance(value, float) else f"{name:20} {value}")
@@ -0,0 +1,156 @@
+import logging
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s:%(levelname)s:%(funcName)s: %(message)s",
+    datefmt="%H:%M:%S"
+)
+logger = logging.getLogger(__name__)
+
+import asyncio, math, os, pathlib, pickle, time
+from array import array
+
+from OpenSea.collection_record import CollectionRecord
+
+
+class StateSnapshot:
+    """Бинарный снимок slugs_data и состояния уведомлений, чтобы после перезапуска не ждать полный скан"""
+
+    VERSION = 1
+
+    NUMERIC_FIELDS = ("floor_usd", "floor_native", "offer_usd", "offer_native", "volume_1d_usd")
+    TEXT_FIELDS = ("floor_currency", "offer_currency")
+
+    def __init__(
+            self,
+            scraper,
+            notify_creator,
+            path: pathlib.Path,
+            interval: float = 60,
+            max_age: float = 900
+        ):
+        self.scraper = scraper
+        self.notify_creator = notify_creator
+        self.path = pathlib.Path(path)
+        self.interval = interval   # секунд между сохранениями
+        self.max_age = max_age     # снимок старше этого не считается полным сканом
+
+
+
+    def dump_collections(self) -> dict:
+        """Колонки записей: числа в array('d') с NaN вместо None, валюты списками"""
+        records = list(self.scraper.slugs_data.values())
+
+        columns = {"slug": [record.slug for record in records]}
+
+        for field in self.NUMERIC_FIELDS:
+            columns[field] = array('d', (
+                math.nan if (value := getattr(record, field)) is None else value
+                for record in records
+            ))
+
+        for field in self.TEXT_FIELDS:
+            columns[field] = [getattr(record, field) for record in records]
+
+        return columns
+
+
+
+    def dump(self, notify_state: dict) -> bytes:
+        return pickle.dumps({
+            "version": self.VERSION,
+            "saved_at": time.time(),
+            "full_scanned": self.scraper.full_scanned,
+            "collections": self.dump_collections(),
+            "notify": notify_state,
+        }, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+
+    def write(self, data: bytes):
+        temp_path = self.path.with_suffix(".tmp")
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, self.path)
+
+
+
+    async def save(self):
+        loop = asyncio.get_running_loop()
+
+        # Состояние уведомлений снимается в потоке, который им владеет. Без NotifyCreator (роль ingest) только коллекции
+        notify_state = {}
+        if self.notify_creator:
+            notify_state = await loop.run_in_executor(self.notify_creator.executor, self.notify_creator.dump_state)
+        data = self.dump(notify_state)
+
+        await loop.run_in_executor(None, self.write, data)
+        logger.debug(f"Snapshot saved: {len(self.scraper.slugs_data)} collections, {len(data)} bytes")
+
+
+
+    def save_sync(self):
+        """Сохранение при остановке, когда event loop уже завершается"""
+        try:
+            notify_state = {}
+            if self.notify_creator:
+                notify_state = self.notify_creator.executor.submit(self.notify_creator.dump_state).result(timeout=10)
+            self.write(self.dump(notify_state))
+            logger.info(f"Snapshot saved on shutdown: {len(self.scraper.slugs_data)} collections")
+        except Exception as e:
+            logger.error(f"Error saving snapshot: {e}")
+
+
+
+    def load(self) -> bool:
+        """Загружает снимок целиком в slugs_data, индекс объемов и NotifyCreator"""
+        try:
+            with open(self.path, "rb") as f:
+                snapshot = pickle.load(f)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.error(f"Error loading snapshot: {e}")
+            return False
+
+        if snapshot.get("version") != self.VERSION:
+            logger.warning(f"Snapshot version {snapshot.get('version')} is not supported")
+            return False
+
+        columns = snapshot["collections"]
+        slugs_data = self.scraper.slugs_data
+        volume_rank = self.scraper.volume_rank
+
+        for index, slug in enumerate(columns["slug"]):
+            record = CollectionRecord(slug)
+
+            for field in self.NUMERIC_FIELDS:
+                value = columns[field][index]
+                setattr(record, field, None if math.isnan(value) else value)
+
+            for field in self.TEXT_FIELDS:
+                setattr(record, field, columns[field][index])
+
+            record.update_derived()
+
+            slugs_data[slug] = record
+            volume_rank.update(slug, record.volume_1d_usd)
+
+        if self.notify_creator:
+            self.notify_creator.load_state(snapshot["notify"])
+
+        age = time.time() - snapshot["saved_at"]
+        if snapshot["full_scanned"] and age <= self.max_age:
+            self.scraper.full_scanned = True
+
+        logger.info(f"Snapshot loaded: {len(columns['slug'])} collections, {age:.0f}s old, full_scanned={self.scraper.full_scanned}")
+        return True
+
+
+
+    async def run_periodic(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.save()
+            except Exception as e:
+                logger.error(f"Error saving snapshot: {e}")
@@ -0,0 +1,190 @@
+import logging
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s:%(levelname)s:%(funcName)s: %(message)s",
+    datefmt="%H:%M:%S"
+)
+logger = logging.getLogger(__name__)
+
+import aiofiles, json, pathlib, time
+
+
+class Subscription:
+    __slots__ = ("id", "slugs", "state", "sent_at", "frames", "errors")
+
+    def __init__(self, id: str, slugs: set[str]):
+        self.id = id
+        self.slugs = slugs
+        self.state = "pending"   # pending -> active после первого next, error, completed
+        self.sent_at = time.time()
+        self.frames = 0
+        self.errors = []
+
+
+
+class SubscriptionRegistry:
+    """Подписки одного WebSocket подключения: id -> коллекции и коллекция -> id"""
+
+    def __init__(self):
+        self.subscriptions: dict[str, Subscription] = {}
+        self.slug_ids: dict[str, str] = {}
+
+
+
+    def clear(self):
+        self.subscriptions.clear()
+        self.slug_ids.clear()
+
+
+
+    def add(self, id: str, slugs: set[str]) -> Subscription:
+        subscription = self.subscriptions[id] = Subscription(id, slugs)
+        for slug in slugs:
+            self.slug_ids[slug] = id
+        return subscription
+
+
+
+    def remove(self, id: str) -> Subscription:
+        subscription = self.subscriptions.pop(id, None)
+        if subscription:
+            for slug in subscription.slugs:
+                if self.slug_ids.get(slug) == id:
+                    del self.slug_ids[slug]
+        return subscription
+
+
+
+    def ids_for(self, slugs: set[str]) -> set[str]:
+        return {id for slug in slugs if (id := self.slug_ids.get(slug))}
+
+
+
+    def on_next(self, id: str):
+        if subscription := self.subscriptions.get(id):
+            subscription.state = "active"
+            subscription.frames += 1
+
+
+
+    def on_error(self, id: str, payload):
+        if subscription := self.subscriptions.get(id):
+            subscription.state = "error"
+            subscription.errors.append(payload)
+            logger.error(f"Subscription {id} ({len(subscription.slugs)} slugs) error: {payload}")
+
+
+
+    def on_complete(self, id: str) -> Subscription:
+        """Сервер завершил подписку. Возвращает ее, чтобы коллекции можно было подписать заново"""
+        return self.remove(id)
+
+
+
+    def states(self) -> dict[str, int]:
+        states = {"pending": 0, "active": 0, "error": 0}
+        for subscription in self.subscriptions.values():
+            states[subscription.state] = states.get(subscription.state, 0) + 1
+        return states
+
+
+
+class SubscriptionStore:
+    """Сохраненный набор коллекций: снимок collections.json и журнал изменений +slug/-slug"""
+
+    def __init__(self, file_dir: pathlib.Path, compact_after: int = 10_000):
+        self.snapshot_file = file_dir / "collections.json"
+        self.journal_file = file_dir / "collections.journal"
+        self.compact_after = compact_after
+
+        self.slugs: set[str] = set()
+        self.journal_lines = 0
+
+        # False, если снимок не прочитан и остался на месте: перезапись стерла бы сохраненный список
+        self.can_compact = True
+
+
+
+    async def load(self) -> set[str]:
+        """Читает снимок, применяет журнал и сжимает их в новый снимок.
+
+        Нечитаемый снимок переименовывается в .bad, а если и это не удалось - остается на месте без сжатия.
+        """
+        self.slugs = set()
+        self.can_compact = True
+
+        try:
+            async with aiofiles.open(self.snapshot_file, "r") as f:
+                self.slugs = set(json.loads(await f.read()))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Error loading collections: {e}")
+
+            bad_file = self.snapshot_file.with_suffix(".json.bad")
+            try:
+                self.snapshot_file.replace(bad_file)
+                logger.warning(f"Unreadable {self.snapshot_file.name} moved to {bad_file.name}")
+            except OSError as e:
+                logger.error(f"Error moving {self.snapshot_file.name}, it will not be compacted: {e}")
+                self.can_compact = False
+
+        try:
+            async with aiofiles.open(self.journal_file, "r") as f:
+                async for line in f:
+                    if line.startswith("+"):
+                        self.slugs.add(line[1:].rstrip("\n"))
+                    elif line.startswith("-"):
+                        self.slugs.discard(line[1:].rstrip("\n"))
+        except FileNotFoundError:
+            pass
+
+        if self.can_compact:
+            await self.compact()
+        return set(self.slugs)
+
+
+
+    async def compact(self):
+        if not self.can_compact:
+            return
+
+        try:
+            async with aiofiles.open(self.snapshot_file, "w") as f:
+                await f.write(json.dumps(
+                    sorted(self.slugs),
+                    separators=(',', ':')
+                ))
+            async with aiofiles.open(self.journal_file, "w") as f:
+                await f.write("")
+
+            self.journal_lines = 0
+            logger.info(f"Saved {len(self.slugs)} collections to file.")
+        except Exception as e:
+            logger.error(f"Error saving collections to file: {e}")
+
+
+
+    async def update(self, added: set[str] = (), removed: set[str] = ()):
+        """Дописывает в журнал только изменения"""
+        added = set(added) - self.slugs
+        removed = set(removed) & self.slugs
+
+        if not (added or removed):
+            return
+
+        self.slugs |= added
+        self.slugs -= removed
+
+        lines = [f"+{slug}\n" for slug in added] + [f"-{slug}\n" for slug in removed]
+
+        try:
+            async with aiofiles.open(self.journal_file, "a") as f:
+                await f.write("".join(lines))
+        except Exception as e:
+            logger.error(f"Error saving collections to file: {e}")
+
+        self.journal_lines += len(lines)
+
+        if self.journal_lines >= self.compact_after:
+            await self.compact()
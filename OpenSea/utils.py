@@ -5,9 +5,8 @@ def get_usd_price(data, key):
 
 def get_native_price(data, key):
     """Получает цену в нативной валюте проверяя на ошибки"""
-    return {'price': native['unit'], 'currency': native['symbol']} if (value := data.get(key)) and (native := value["pricePerItem"]["native"]) and native.get("unit") and native.get("symbol") else None
+    return {'price': native['unit'], 'currency': native['symbol']} if (value := data.get(key)) and (price := value.get("pricePerItem")) and (native := price.get("native")) and native.get("unit") and native.get("symbol") else None
 
-def deep_dict_update(dict_for_update: dict, new_data: dict):
-    for key, value in new_data.items():
-        if isinstance(value, dict) and isinstance(dict_for_update.get(key), dict): deep_dict_update(dict_for_update[key], value)
-        else: dict_for_update[key] = value
+def get_1d_volume(data):
+    """Получает 1d объем в USD проверяя на ошибки"""
+    return volume.get("usd") if (stats := data.get("stats")) and (oneDay := stats.get("oneDay")) and (volume := oneDay.get("volume")) else None
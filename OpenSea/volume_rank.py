@@ -0,0 +1,62 @@
+from sortedcontainers import SortedList
+
+
+class VolumeRankIndex:
+    """Индекс коллекций, отсортированный по 1d объему в USD (по убыванию)"""
+
+    def __init__(self):
+        self.volumes: dict[str, float] = {}
+        self.ranking = SortedList()
+
+
+
+    def __len__(self):
+        return len(self.volumes)
+
+
+
+    def update(self, slug: str, volume):
+        """Обновляет объем коллекции в индексе. None убирает коллекцию из рейтинга"""
+        if volume is None:
+            return self.remove(slug)
+
+        old_volume = self.volumes.get(slug)
+
+        if old_volume == volume:
+            return
+
+        if old_volume is not None:
+            self.ranking.remove((-old_volume, slug))
+
+        self.volumes[slug] = volume
+        self.ranking.add((-volume, slug))
+
+
+
+    def remove(self, slug: str):
+        if (old_volume := self.volumes.pop(slug, None)) is not None:
+            self.ranking.remove((-old_volume, slug))
+
+
+
+    def rank(self, slug: str):
+        """Позиция коллекции в рейтинге начиная с 0, None если коллекции нет в индексе"""
+        if (volume := self.volumes.get(slug)) is None:
+            return None
+
+        return self.ranking.index((-volume, slug))
+
+
+
+    def top(self, count: int) -> list[str]:
+        """Первые count коллекций рейтинга"""
+        return [slug for _, slug in self.ranking.islice(0, max(count, 0))]
+
+
+
+    def is_top_N(self, slug: str, top_volume) -> bool:
+        if 0 >= top_volume:
+            return False
+
+        rank = self.rank(slug)
+        return rank is not None and rank < top_volume
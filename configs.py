@@ -1,4 +1,12 @@
-import asyncio, aiofiles, json
+import logging
+logging.basicConfig(
+    level=logging.DEBUG, 
+    format="%(asctime)s:%(levelname)s:%(funcName)s: %(message)s",
+    datefmt="%H:%M:%S"
+)
+logger = logging.getLogger(__name__)
+
+import asyncio, json, pathlib, sqlite3, threading
 from collections import defaultdict
 
 class OpenSeaConfig():
@@ -17,6 +25,12 @@ class OpenSeaConfig():
         # alert_rules
         self.diff_percent_offer_to_floor: float = float('-inf')
 
+        # оконные alert_rules: floor упал на X% от максимума за окно, topOffer вырос на Y% от минимума за окно
+        self.floor_drop_percent: float = float('inf')
+        self.floor_drop_window: int = 300  # seconds
+        self.offer_rise_percent: float = float('inf')
+        self.offer_rise_window: int = 3600 # seconds
+
         if import_config and isinstance(import_config, dict):
             import_config['blacklist'] = set(import_config.get('blacklist', []))
             self.__dict__.update(import_config)
@@ -39,13 +53,129 @@ def load_configs(file_path = "OpenSea/configs.json") -> dict[int, OpenSeaConfig]
 
 
 
+class ConfigStore:
+    """Конфиги пользователей в SQLite в режиме WAL: строка на пользователя, пишутся только измененные"""
+
+    def __init__(self, path: pathlib.Path, legacy_json: pathlib.Path = None):
+        self.path = pathlib.Path(path)
+        self.legacy_json = legacy_json   # configs.json прошлых версий, переносится при первом запуске
+
+        # Запись идет из потока asyncio.to_thread, соединение общее
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS opensea_configs (user_id INTEGER PRIMARY KEY, config TEXT NOT NULL)")
+
+
+
+    def load_all(self) -> dict[int, OpenSeaConfig]:
+        """Все конфиги одним запросом"""
+        with self.lock:
+            rows = self.connection.execute("SELECT user_id, config FROM opensea_configs").fetchall()
+
+        if not rows and self.legacy_json and pathlib.Path(self.legacy_json).exists():
+            configs = load_configs(self.legacy_json)
+            self.write([(user_id, json.dumps(config.save_config())) for user_id, config in configs.items()])
+            logger.info(f"Migrated {len(configs)} configs from {self.legacy_json} to {self.path}")
+            return configs
+
+        return {user_id: OpenSeaConfig(json.loads(config)) for user_id, config in rows}
+
+
+
+    def write(self, rows: list[tuple[int, str]]):
+        """Одна транзакция на пачку строк (user_id, json)"""
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                self.connection.executemany(
+                    "INSERT INTO opensea_configs (user_id, config) VALUES (?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET config = excluded.config",
+                    rows
+                )
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+
+
+
 class BuildConfigs:
         lock = asyncio.Lock()
+
+        store = ConfigStore(
+            pathlib.Path(__file__).parent / "OpenSea" / "configs.sqlite3",
+            legacy_json=pathlib.Path(__file__).parent / "OpenSea" / "configs.json"
+        )
+
         opensea: defaultdict[int, OpenSeaConfig] = defaultdict(OpenSeaConfig)
-        opensea.update(load_configs('./OpenSea/configs.json'))
+        opensea.update(store.load_all())
+
+        # Пользователи с несохраненными изменениями, пишутся одной транзакцией через SAVE_DELAY после первого изменения
+        dirty: set[int] = set()
+        save_task: asyncio.Task = None
+        SAVE_DELAY = 1.0 # seconds
+
+        # Вызываются с user_id при каждом изменении конфига в потоке event loop
+        listeners: list[callable] = []
+
+        @classmethod
+        def add_listener(cls, listener: callable):
+            cls.listeners.append(listener)
+
+        @classmethod
+        def config_changed(cls, user_id: int):
+            """Сообщает слушателям об изменении конфига или о возврате уведомлений после /config"""
+            for listener in cls.listeners:
+                listener(user_id)
+
+        @classmethod
+        def apply_configs(cls, configs: dict, only_changed: bool = False):
+            """Заменяет конфиги, полученные от другого процесса, без записи в базу.
+
+            only_changed - полная синхронизация: совпадающие конфиги пропускаются и слушатели о них не узнают
+            """
+            for user_id, config in configs.items():
+                if only_changed and user_id in cls.opensea and cls.opensea[user_id].save_config() == config:
+                    continue
+
+                cls.opensea[user_id] = OpenSeaConfig(config)
+                cls.config_changed(user_id)
 
         @classmethod
-        async def save_configs(cls, file_path = "OpenSea/configs.json"):
+        def save_config(cls, user_id: int):
+            """Отмечает конфиг пользователя измененным и планирует отложенную запись"""
+            cls.dirty.add(user_id)
+            cls.config_changed(user_id)
+
+            if cls.save_task is None or cls.save_task.done():
+                cls.save_task = asyncio.create_task(cls.save_later())
+
+        @classmethod
+        async def save_later(cls):
+            await asyncio.sleep(cls.SAVE_DELAY)
+            await cls.save_configs()
+
+        @classmethod
+        async def save_configs(cls):
+            """Пишет все измененные конфиги"""
             async with cls.lock:
-                async with aiofiles.open(file_path, "w") as f:
-                    await f.write(json.dumps({str(user_id): config.save_config() for user_id, config in cls.opensea.items()}, indent=4))
\ No newline at end of file
+                dirty, cls.dirty = cls.dirty, set()
+
+                # Сериализация в потоке event loop, где конфиги меняются
+                rows = [(user_id, json.dumps(cls.opensea[user_id].save_config())) for user_id in dirty]
+                if not rows:
+                    return
+
+                try:
+                    await asyncio.to_thread(cls.store.write, rows)
+                except Exception as e:
+                    cls.dirty |= dirty
+                    logger.error(f"Error saving configs: {e}")
+
+        @classmethod
+        def save_configs_sync(cls):
+            """Запись оставшихся изменений при остановке"""
+            dirty, cls.dirty = cls.dirty, set()
+            cls.store.write([(user_id, json.dumps(cls.opensea[user_id].save_config())) for user_id in dirty])
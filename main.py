@@ -11,32 +11,139 @@ import asyncio, aiohttp, os
 from OpenSea.opensea import OpenSea_Scraper
 from telegram_bot.bot import TelegramBot
 from telegram_bot.message_manager import NotificationManagerFactory
+from metrics import Metrics
+from configs import BuildConfigs
+from transport import TransportClient
+from OpenSea.remote import UpdateForwarder, RemoteEvaluator
+from telegram_bot.remote import RemoteDelivery
 
 from dotenv import load_dotenv; load_dotenv()
 TG_BOT_TOKEN = os.getenv("TG_BOT_TOKEN")
+TG_MESSAGES_PER_SECOND = float(os.getenv("TG_MESSAGES_PER_SECOND", 30))
+OPENSEA_QUERY_MODE = os.getenv("OPENSEA_QUERY_MODE", "full")
+OPENSEA_SCAN_MODE = os.getenv("OPENSEA_SCAN_MODE", "sequential")
+OPENSEA_WS_CONNECTIONS = int(os.getenv("OPENSEA_WS_CONNECTIONS", 1))
+OPENSEA_WS_PRIORITY_TOP = int(os.getenv("OPENSEA_WS_PRIORITY_TOP", 0))
+OPENSEA_SUBSCRIPTION_TTL = float(os.getenv("OPENSEA_SUBSCRIPTION_TTL", 3600))
+OPENSEA_NOTIFICATION_BUFFER_SIZE = int(os.getenv("OPENSEA_NOTIFICATION_BUFFER_SIZE", 10_000))
+OPENSEA_NOTIFICATION_OVERLOAD_POLICY = os.getenv("OPENSEA_NOTIFICATION_OVERLOAD_POLICY", "drop_oldest")
+OPENSEA_CAPTURE_PATH = os.getenv("OPENSEA_CAPTURE_PATH") or None
+OPENSEA_EVALUATION_PROCESSES = int(os.getenv("OPENSEA_EVALUATION_PROCESSES", 0))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+ROLE = os.getenv("ROLE", "all")
+EVALUATE_SOCKET = os.getenv("EVALUATE_SOCKET", "evaluate.sock")
+DELIVER_SOCKET = os.getenv("DELIVER_SOCKET", "deliver.sock")
 
 
 
-async def init():
+def scraper_options() -> dict:
+    return dict(
+        query_mode=OPENSEA_QUERY_MODE,
+        scan_mode=OPENSEA_SCAN_MODE,
+        ws_connections=OPENSEA_WS_CONNECTIONS,
+        ws_priority_top=OPENSEA_WS_PRIORITY_TOP,
+        subscription_ttl=OPENSEA_SUBSCRIPTION_TTL,
+        notification_buffer_size=OPENSEA_NOTIFICATION_BUFFER_SIZE,
+        notification_overload_policy=OPENSEA_NOTIFICATION_OVERLOAD_POLICY,
+        capture_path=OPENSEA_CAPTURE_PATH,
+        evaluation_processes=OPENSEA_EVALUATION_PROCESSES
+    )
+
+
+
+def create_notification_managers(tg: TelegramBot) -> NotificationManagerFactory:
+    return NotificationManagerFactory(
+        send_message=tg.bot.send_message,
+        parse_mode='HTML',
+        disable_web_page_preview=True,
+        messages_per_second=TG_MESSAGES_PER_SECOND
+    )
+
+
+
+async def run_all():
+    """Все стадии в одном event loop"""
     async with aiohttp.ClientSession() as session:
         tg = TelegramBot(token=TG_BOT_TOKEN)
 
-        notification_managers = NotificationManagerFactory(
-            send_message=tg.bot.send_message,
-            parse_mode='HTML',
-            disable_web_page_preview=True
-        )
-
         opensea = OpenSea_Scraper(
             session=session,
-            notification_managers=notification_managers
+            notification_managers=create_notification_managers(tg),
+            **scraper_options()
         )
 
         asyncio.create_task(tg.start())
         log.info("Telegram bot started")
+        try:
+            await opensea.run()
+        finally:
+            BuildConfigs.save_configs_sync()
+
+
+
+async def run_ingest():
+    """WebSocket и скан топ листа, обновления уходят роли evaluate"""
+    async with aiohttp.ClientSession() as session:
+        updates = TransportClient(EVALUATE_SOCKET)
+
+        opensea = OpenSea_Scraper(
+            session=session,
+            notification_managers=None,
+            evaluate=False,
+            **scraper_options()
+        )
+
+        Metrics.add_stats("transport_updates", updates.stats, "Sent update frames")
+
+        updates.start()
+        asyncio.create_task(UpdateForwarder(opensea, updates).run())
         await opensea.run()
-        print("OpenSea scraper started")
-        await asyncio.sleep(1)
+
+
+
+async def run_evaluate():
+    """Проверка уведомлений по обновлениям от ingest, уведомления уходят роли deliver"""
+    evaluator = RemoteEvaluator(
+        EVALUATE_SOCKET,
+        DELIVER_SOCKET,
+        notification_buffer_size=OPENSEA_NOTIFICATION_BUFFER_SIZE,
+        notification_overload_policy=OPENSEA_NOTIFICATION_OVERLOAD_POLICY,
+        evaluation_processes=OPENSEA_EVALUATION_PROCESSES
+    )
+    await evaluator.run()
+
+
+
+async def run_deliver():
+    """Telegram бот и отправка уведомлений от evaluate"""
+    tg = TelegramBot(token=TG_BOT_TOKEN)
+
+    delivery = RemoteDelivery(create_notification_managers(tg), DELIVER_SOCKET, EVALUATE_SOCKET)
+    await delivery.start()
+
+    try:
+        await tg.start()
+    finally:
+        BuildConfigs.save_configs_sync()
+
+
+
+ROLES = {
+    "all": run_all,
+    "ingest": run_ingest,
+    "evaluate": run_evaluate,
+    "deliver": run_deliver,
+}
+
+
+
+async def init():
+    if METRICS_PORT:
+        await Metrics.start_server(METRICS_HOST, METRICS_PORT)
+
+    log.info(f"Role: {ROLE}")
+    await ROLES[ROLE]()
 
 
 if __name__ == "__main__":
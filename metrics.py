@@ -0,0 +1,237 @@
+import logging
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s:%(levelname)s:%(funcName)s: %(message)s",
+    datefmt="%H:%M:%S"
+)
+logger = logging.getLogger(__name__)
+
+import asyncio, math
+from bisect import bisect_left
+
+from aiohttp import web
+
+
+# Границы корзин гистограмм, секунды: от декодирования одного сообщения до полного скана топ листа
+BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60,
+)
+
+
+def format_value(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    return repr(float(value))
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+
+def format_metric(name: str, kind: str, help: str, samples) -> list[str]:
+    """Строки одной метрики в текстовом формате Prometheus, samples - пары (labels, value)"""
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    lines.extend(f"{name}{format_labels(labels)} {format_value(value)}" for labels, value in samples)
+    return lines
+
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self.enabled = False
+
+
+
+    def inc(self, amount: float = 1):
+        if self.enabled:
+            self.value += amount
+
+
+
+    def render(self) -> list[str]:
+        return format_metric(self.name, "counter", self.help, [({}, self.value)])
+
+
+
+class Gauge:
+    """Значение задается set() или считается функцией в момент запроса метрик"""
+
+    def __init__(self, name: str, help: str, function: callable = None):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self.function = function
+        self.enabled = False
+
+
+
+    def set(self, value: float):
+        if self.enabled:
+            self.value = value
+
+
+
+    def render(self) -> list[str]:
+        value = self.function() if self.function else self.value
+        return format_metric(self.name, "gauge", self.help, [({}, value)])
+
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple = BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # последняя корзина - +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.enabled = False
+
+
+
+    def observe(self, value: float):
+        if not self.enabled:
+            return
+
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{format_value(bound)}"}} {cumulative}')
+
+        lines.append(f"{self.name}_sum {format_value(self.sum)}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+
+
+class Metrics:
+    """Метрики конвейера от сообщения WebSocket до отправки в Telegram.
+
+    Пока сервер метрик не запущен, observe/inc/set сразу возвращаются, а сборщики не вызываются.
+    """
+
+    enabled = False
+
+    ws_decode    = Histogram("opensea_ws_decode_seconds",          "WebSocket frame decode time")
+    merge        = Histogram("opensea_merge_seconds",              "manage_prices merge into slugs_data")
+    queue_wait   = Histogram("opensea_notification_queue_wait_seconds", "Time a collection waits in notification_queue")
+    evaluation   = Histogram("opensea_evaluation_seconds",         "Notification evaluation time per batch")
+    outbox_wait  = Histogram("telegram_outbox_wait_seconds",       "Time from add_message to send for the oldest message in a send")
+    send         = Histogram("telegram_send_seconds",              "Telegram send_message call duration")
+    scan         = Histogram("opensea_scan_seconds",               "Full top list scan duration")
+    loop_lag     = Histogram("event_loop_lag_seconds",             "Event loop wakeup delay")
+
+    sent         = Counter("telegram_messages_sent_total",         "Combined messages sent to Telegram")
+    send_errors  = Counter("telegram_send_errors_total",           "Failed send_message calls")
+    retry_after  = Counter("telegram_retry_after_total",           "TelegramRetryAfter responses")
+
+    loop_lag_last = Gauge("event_loop_lag_last_seconds",           "Last measured event loop wakeup delay")
+
+    instruments = [
+        ws_decode, merge, queue_wait, evaluation, outbox_wait, send, scan, loop_lag,
+        sent, send_errors, retry_after, loop_lag_last,
+    ]
+
+    # Функции, которые при запросе метрик возвращают готовые строки
+    collectors: list[callable] = []
+
+
+    @classmethod
+    def enable(cls):
+        cls.enabled = True
+        for instrument in cls.instruments:
+            instrument.enabled = True
+
+
+    @classmethod
+    def add_gauge(cls, name: str, help: str, function: callable):
+        cls.instruments.append(Gauge(name, help, function))
+
+
+    @classmethod
+    def add_collector(cls, collector: callable):
+        cls.collectors.append(collector)
+
+
+    @classmethod
+    def add_stats(cls, prefix: str, stats: dict, help: str):
+        """Экспортирует числовые поля словаря статистики как gauge {prefix}_{ключ}"""
+        def collect():
+            lines = []
+            for key, value in stats.items():
+                if isinstance(value, (int, float)):
+                    lines.extend(format_metric(f"{prefix}_{key}", "gauge", f"{help}: {key}", [({}, value)]))
+            return lines
+
+        cls.add_collector(collect)
+
+
+    @classmethod
+    def render(cls) -> str:
+        lines = []
+
+        for instrument in cls.instruments:
+            lines.extend(instrument.render())
+
+        for collector in cls.collectors:
+            try:
+                lines.extend(collector())
+            except Exception as e:
+                logger.error(f"Error collecting metrics: {e}")
+
+        return "\n".join(lines) + "\n"
+
+
+    @classmethod
+    async def handle_metrics(cls, request: web.Request) -> web.Response:
+        return web.Response(text=cls.render(), content_type="text/plain", charset="utf-8")
+
+
+    @classmethod
+    async def start_server(cls, host: str = "127.0.0.1", port: int = 9108) -> web.AppRunner:
+        """Включает метрики и отдает их на http://host:port/metrics"""
+        cls.enable()
+
+        app = web.Application()
+        app.router.add_get("/metrics", cls.handle_metrics)
+
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+
+        asyncio.create_task(cls.watch_loop_lag())
+
+        logger.info(f"Metrics: http://{host}:{port}/metrics")
+        return runner
+
+
+    @classmethod
+    async def watch_loop_lag(cls, interval: float = 0.5):
+        """Насколько позже запланированного event loop будит задачу"""
+        loop = asyncio.get_running_loop()
+
+        while True:
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+
+            lag = max(0.0, loop.time() - expected)
+            cls.loop_lag.observe(lag)
+            cls.loop_lag_last.set(lag)
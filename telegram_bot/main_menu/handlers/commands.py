@@ -13,6 +13,7 @@ router = Router()
 async def cmd_start(message: Message):
     if message.chat.type == 'private' and message.from_user.id not in BuildConfigs.opensea:
         BuildConfigs.opensea[message.from_user.id] = OpenSeaConfig()
+        BuildConfigs.save_config(message.from_user.id)
         await message.answer("Вам теперь будут приходить уведомления.")
     else:
         await message.answer("Вы уже подписаны на уведомления. Для смены настроек используйте /config.")
@@ -36,4 +37,6 @@ async def cmd_cancel(message: Message, state: FSMContext):
     if message.chat.type == 'private':
         await state.clear()
         Utils.is_send_notifications[message.from_user.id] = True
+        if message.from_user.id in BuildConfigs.opensea:
+            BuildConfigs.config_changed(message.from_user.id)
         await message.answer("Действия отменены. Вы можете начать заново, используя /config.")
\ No newline at end of file
@@ -1,11 +1,12 @@
 import logging
 
-import asyncio
-from collections import deque
+import asyncio, heapq, itertools, re, time
+from collections import OrderedDict, deque
 
 from aiogram.exceptions import TelegramRetryAfter
 
 from telegram_bot.utils import Utils
+from metrics import Metrics, format_metric
 
 logging.basicConfig(level=logging.WARNING)
 log = logging.getLogger(__name__)
@@ -14,32 +15,222 @@ log = logging.getLogger(__name__)
 
 class NotificationManagerFactory:
 
-    def __init__(self, send_message: callable, *args, **kwargs):
-        self.send_message = send_message
+    def __init__(self, send_message: callable, *args, messages_per_second: float = 30, **kwargs):
+        self.scheduler = DeliveryScheduler(send_message, *args, messages_per_second=messages_per_second, **kwargs)
+
+        Metrics.add_collector(self.collect_metrics)
+
+
+
+    @property
+    def managers(self) -> dict:
+        return self.scheduler.managers
+
+
+
+    def collect_metrics(self) -> list[str]:
+        """Глубина очередей чатов: общая и по каждому чату с непустой очередью"""
+        depths = {
+            chat_id: depth
+            for chat_id, manager in self.managers.items()
+            if (depth := len(manager.messages))
+        }
+
+        return (
+            format_metric("telegram_outbox_depth_total", "gauge", "Messages waiting in all chat outboxes", [({}, sum(depths.values()))])
+            + format_metric("telegram_outbox_chats", "gauge", "Chats with a message manager", [({}, len(self.managers))])
+            + format_metric("telegram_outbox_scheduled", "gauge", "Chats waiting for their next send time", [({}, len(self.scheduler.heap))])
+            + format_metric("telegram_outbox_ready", "gauge", "Chats waiting for a bot-wide send token", [({}, len(self.scheduler.ready))])
+            + format_metric("telegram_rate_tokens", "gauge", "Bot-wide send tokens left", [({}, self.scheduler.limiter.tokens)])
+            + format_metric("telegram_outbox_depth", "gauge", "Messages waiting in a chat outbox", [({"chat_id": chat_id}, depth) for chat_id, depth in depths.items()])
+        )
+
+
+
+    async def add_message(self, user_id, message, key=None):
+        """key - slug коллекции: новое сообщение с тем же key заменяет еще не отправленное"""
+        if Utils.is_send_notifications[user_id]:
+            log.debug(f"Adding message to {user_id}")
+            self.scheduler.add_message(user_id, message, key)
+
+
+
+
+
+class TokenBucket:
+    """Общий лимит бота: rate сообщений в секунду с запасом capacity"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = 0.0
+
+
+
+    def refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+
+
+    def try_acquire(self, now: float) -> bool:
+        self.refill(now)
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+
+        return False
+
+
+
+    def next_available(self, now: float) -> float:
+        self.refill(now)
+        return now + max(0.0, 1 - self.tokens) / self.rate
+
+
+
+
+
+class DeliveryScheduler:
+    """Одна задача отправки на все чаты: очереди чатов и min-heap времени, когда чат снова может отправлять.
+
+    Задача просыпается только к ближайшему такому времени или при новом сообщении в пустой чат.
+    Чаты, у которых прошла задержка, встают в очередь ready и по кругу получают токены общего лимита бота,
+    поэтому один чат с большой очередью не забирает отправки у остальных.
+    Чаты без сообщений и без ограничений удаляются раз в RECLAIM_INTERVAL.
+    """
+
+    RECLAIM_INTERVAL = 60 # seconds
+
+    def __init__(self, send_message: callable, *args, messages_per_second: float = 30, **kwargs):
+        self._send_message = send_message
         self.args = args
         self.kwargs = kwargs
 
-        self.managers = {}
+        self.managers: dict[int, MessageManager] = {}
+
+        self.heap: list[tuple[float, int]] = []   # (время, chat_id), устаревшие записи пропускаются
+        self.ready: deque[MessageManager] = deque()
+        self.limiter = TokenBucket(messages_per_second)
+        self.wakeup = asyncio.Event()
+        self.task: asyncio.Task = None
+
+        self.next_reclaim = 0.0
+
+
+
+    def add_message(self, chat_id, message, key=None):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+        if (manager := self.managers.get(chat_id)) is None:
+            manager = self.managers[chat_id] = MessageManager(chat_id, self._send_message, *self.args, **self.kwargs)
+
+        manager.add_message(message, key)
+        self.schedule(manager)
+
+
+
+    def schedule(self, manager: "MessageManager"):
+        """Ставит чат в heap к его следующему времени отправки, если он еще не там и не отправляет"""
+        if manager.sending or manager.scheduled_at is not None or not manager.messages:
+            return
+
+        eligible_at = manager.next_send_time()
+        manager.scheduled_at = eligible_at
+
+        heapq.heappush(self.heap, (eligible_at, manager.chat_id))
 
+        if self.heap[0][1] == manager.chat_id:
+            self.wakeup.set()
 
 
-    async def add_message(self, user_id, message):
-        if user_id not in self.managers:
-            self.managers[user_id] = MessageManager(
-                chat_id=user_id,
-                send_message=self.send_message,
-                *self.args,
-                **self.kwargs
-            )
-        
-        await self.managers[user_id].add_message(message)
+
+    async def deliver(self, manager: "MessageManager"):
+        try:
+            parts = manager.take_messages()
+            if parts:
+                await manager.send_message(manager.combine_messages(parts), parts)
+
+        except Exception as e:
+            log.error(f"Error delivering to {manager.chat_id}: {e}")
+
+        finally:
+            manager.sending = False
+            self.schedule(manager)
+
+
+
+    def reclaim_idle(self, now: float):
+        idle = [
+            chat_id
+            for chat_id, manager in self.managers.items()
+            if manager.is_idle(now)
+        ]
+
+        for chat_id in idle:
+            del self.managers[chat_id]
+
+        if idle:
+            log.debug(f"Reclaimed {len(idle)} idle chats, {len(self.managers)} left")
+
+
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        heap = self.heap
+        ready = self.ready
+
+        while True:
+            now = loop.time()
+
+            while heap and heap[0][0] <= now:
+                eligible_at, chat_id = heapq.heappop(heap)
+
+                manager = self.managers.get(chat_id)
+                if manager is None or manager.scheduled_at != eligible_at:
+                    continue
+
+                # scheduled_at остается заполненным, пока чат ждет токен в ready
+                ready.append(manager)
+
+            while ready and self.limiter.try_acquire(now):
+                manager = ready.popleft()
+
+                manager.scheduled_at = None
+                manager.sending = True
+                asyncio.create_task(self.deliver(manager))
+
+            if now >= self.next_reclaim:
+                self.reclaim_idle(now)
+                self.next_reclaim = now + self.RECLAIM_INTERVAL
+
+            wakeups = [self.next_reclaim]
+            if heap:
+                wakeups.append(heap[0][0])
+            if ready:
+                wakeups.append(self.limiter.next_available(now))
+
+            timeout = min(wakeups) - now
+
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
 
 
 
 
 
 class MessageManager:
-    """Менеджер, который распределяет отправку сообщений согласно лимитам Telegram Bot API."""
+    """Очередь и темп отправки одного чата согласно лимитам Telegram Bot API. Отправкой управляет DeliveryScheduler."""
+
+    MAX_LENGTH = 4096
+    SEPARATOR = "\n\n"
 
     def __init__(
         self,
@@ -59,10 +250,10 @@ class MessageManager:
         self.kwargs = kwargs
 
         self.chat_id = chat_id
+        self.unkeyed = itertools.count()   # ключи сообщений без slug, они ничего не заменяют
 
-        self.messages = []
-
-        self.cooldown = 10
+        # key -> (сообщение, время добавления), новое сообщение по тому же key заменяет старое на его месте
+        self.messages: OrderedDict[object, tuple[str, float]] = OrderedDict()
 
         self.TIME_WINDOW = 5 # seconds
         self.MESSAGES_LIMIT = self.TIME_WINDOW * 2
@@ -70,26 +261,35 @@ class MessageManager:
         self.MAX_DELAY = 1.0 # seconds
         self.current_delay = self.BASE_DELAY
 
-        self.message_timestamps = deque()
         self.recent_messages_timestamps: deque[float] = deque()
 
         self.flood_control: float = 0.0
 
-        self.queue = asyncio.Queue()
-        self.chat_task = asyncio.create_task(self.process_chat_queue())
+        self.scheduled_at: float = None # время в heap планировщика
+        self.sending = False
 
 
 
-    async def send_message(self, message):
+    async def send_message(self, message, parts: list[tuple]):
+        """parts - (key, сообщение, время добавления) частей, склеенных в message"""
         try:
 
+            started = time.perf_counter()
             await self._send_message(self.chat_id, message, *self.args, **self.kwargs)
+
+            Metrics.send.observe(time.perf_counter() - started)
+            Metrics.sent.inc()
+
             now = asyncio.get_running_loop().time()
             self.recent_messages_timestamps.append(now)
 
+            Metrics.outbox_wait.observe(now - min(added_at for _, _, added_at in parts))
+
         except TelegramRetryAfter as exception:
 
-            await self.queue.put(message)
+            # Части возвращаются в начало очереди, очередь чата сохраняется до конца flood control
+            Metrics.retry_after.inc()
+            self.requeue(parts)
 
             now = asyncio.get_running_loop().time()
             self.flood_control = now + exception.retry_after
@@ -98,30 +298,34 @@ class MessageManager:
 
         except Exception as exception:
 
+            Metrics.send_errors.inc()
             log.error(f"Error sending message to {self.chat_id}: {exception}")
 
 
 
-    def gather_messages(self):
-        while not self.queue.empty():
-            try:
-                self.messages.append(self.queue.get_nowait())
-            except asyncio.QueueEmpty:
-                break
+    def add_message(self, message, key=None):
+        """Добавляет сообщение в очередь для отправки или заменяет ожидающее сообщение с тем же key."""
+        if key is None:
+            key = next(self.unkeyed)
 
+        if (queued := self.messages.get(key)) is not None:
+            self.messages[key] = (message, queued[1])
+        else:
+            self.messages[key] = (message, asyncio.get_running_loop().time())
 
 
-    async def add_message(self, message):
-        """Добавляет сообщение в очередь для отправки."""
-        if Utils.is_send_notifications[self.chat_id]:
-            log.debug(f"Adding message to {self.chat_id}")
-            await self.queue.put(message)
 
+    def requeue(self, parts: list[tuple]):
+        """Возвращает неотправленные части в начало очереди, если их еще не заменили новыми"""
+        for key, message, added_at in reversed(parts):
+            if key not in self.messages:
+                self.messages[key] = (message, added_at)
+                self.messages.move_to_end(key, last=False)
 
 
-    async def clean_timestamps(self):
 
-        now = asyncio.get_running_loop().time()
+    def clean_timestamps(self, now: float):
+
         timestamps = self.recent_messages_timestamps
 
         while timestamps and (now - timestamps[0]) > self.TIME_WINDOW:
@@ -129,82 +333,104 @@ class MessageManager:
 
 
 
-    async def wait_delay(self, end_timestamp: float):
-        """Останавливает весь цикл, и все сообщения накапливаются в очередь."""
+    def take_messages(self) -> list[tuple]:
+        """Забирает из начала очереди столько сообщений, сколько помещается в одно сообщение Telegram"""
+        messages = self.messages
+        max_length = self.MAX_LENGTH
+        length = -len(self.SEPARATOR)
+        count = 0
+
+        for message, _ in messages.values():
+            length += len(self.SEPARATOR) + len(message)
+            if length > max_length and count:
+                break
+            count += 1
+
+        parts = []
+        for _ in range(count):
+            key, (message, added_at) = messages.popitem(last=False)
+            parts.append((key, message, added_at))
+
+        return parts
+
 
-        now = asyncio.get_running_loop().time()
 
-        if now < end_timestamp:
-            await asyncio.sleep(end_timestamp - now)
+    def combine_messages(self, parts: list[tuple]) -> str:
+        """Склеивает части из take_messages: длиннее MAX_LENGTH бывает только одно слишком длинное уведомление"""
+        text = self.SEPARATOR.join(message for _, message, _ in parts)
 
+        if len(text) > self.MAX_LENGTH:
+            text = self.truncate_html(text, self.MAX_LENGTH)
 
+        return text
 
-    async def combine_messages(self) -> str:
-        combined_message = ""
-        max_length = 4096
-        slice = 0
 
-        for message in self.messages:
 
-            spacing = 2 if combined_message else 0
-            if len(combined_message) + spacing + len(message) > max_length:
+    # HTML тег, сущность или перевод строки в тексте уведомления
+    HTML_TOKEN = re.compile(r"<(/?)[a-zA-Z][^>]*>|&#?\w+;|\n")
+
+    @classmethod
+    def truncate_html(cls, text: str, limit: int) -> str:
+        """Обрезает HTML по последнему переводу строки вне тегов до limit.
+
+        Срез посреди тега или сущности Telegram отклоняет целиком (can't parse entities).
+        Если такой строки нет, теги убираются и обрезается простой текст.
+        """
+        depth = 0
+        cut = 0
+
+        for match in cls.HTML_TOKEN.finditer(text):
+            if match.start() > limit:
                 break
 
-            if combined_message:
-                combined_message += "\n\n"
-            combined_message += message
+            token = match.group()
+            if token == "\n":
+                if depth == 0:
+                    cut = match.start()
+            elif token[0] == "<":
+                depth += -1 if match.group(1) else 1
+
+        if cut:
+            return text[:cut]
+
+        plain = re.sub(r"<[^>]*>", "", text)[:limit]
 
-            slice += 1
+        # Не оставлять оборванную сущность в конце
+        if (amp := plain.rfind("&")) != -1 and ";" not in plain[amp:]:
+            plain = plain[:amp]
 
-        self.messages = self.messages[slice:]
-        return combined_message
+        return plain
 
 
 
-    async def control_messages_speed(self):
+    def next_send_time(self) -> float:
+        """Раньше этого времени чат не отправляет: задержка после прошлой отправки и flood control"""
         timestamps = self.recent_messages_timestamps
 
-        await self.clean_timestamps()
+        self.clean_timestamps(asyncio.get_running_loop().time())
         self.current_delay = self.MAX_DELAY if len(timestamps) >= self.MESSAGES_LIMIT else self.BASE_DELAY
 
         last_timestamp = timestamps[-1] if timestamps else 0
-        end_timestamp = max([
+
+        return max([
             0,
             last_timestamp + self.current_delay,
             self.flood_control
         ])
 
-        return end_timestamp
-
-
-
-    async def process_chat_queue(self):
-        
-        while True:
-
 
-            if len(self.messages) > 0 and self.queue.empty():
-                log.info(f"{self.chat_id if self.chat_id==857039354 else ''} No queued messages, only cached. {len(self.messages)}")
-            else:
-                log.info(f"{self.chat_id} Processing queue. {self.queue.qsize()} messages in queue, {len(self.messages)} cached messages")
-                self.messages.append(await self.queue.get())
-            
-            if self.flood_control:
-                log.debug(f"{self.chat_id} Flood control active, waiting until {self.flood_control}")
-                await self.wait_delay(self.flood_control)
-                self.gather_messages()
-                self.messages.clear()
-                self.flood_control = 0.0
-                continue
-            
 
-            end_timestamp = await self.control_messages_speed()
+    def is_idle(self, now: float) -> bool:
+        """Нет сообщений, отправки и ограничений, темп которых нужно помнить"""
+        self.clean_timestamps(now)
 
-            await self.wait_delay(end_timestamp)
-            self.gather_messages()
-            combined_message = await self.combine_messages()
-            if combined_message:
-                await self.send_message(combined_message)
+        return not (
+            self.messages
+            or self.sending
+            or self.scheduled_at is not None
+            or self.recent_messages_timestamps
+            or self.flood_control > now
+        )
 
 
 
@@ -223,10 +449,11 @@ if __name__ == "__main__":
     dp = Dispatcher()
     dp.include_router(router)
 
-    message_manager = MessageManager(bot.send_message, parse_mode='HTML', disable_web_page_preview=True)
+    # MessageManager теперь создается на чат внутри DeliveryScheduler
+    notification_managers = NotificationManagerFactory(bot.send_message, parse_mode='HTML', disable_web_page_preview=True)
 
     async def start_bot():
 
         await dp.start_polling(bot)
 
-    asyncio.run(start_bot())
\ No newline at end of file
+    asyncio.run(start_bot())
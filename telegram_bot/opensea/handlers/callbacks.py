@@ -25,6 +25,8 @@ async def show_opensea_config(callback: CallbackQuery, state: FSMContext):
         f"Лимиты цен <b>{cfg.min_USD_top_offer}-{cfg.max_USD_top_offer}$</b>\n"
         f"Разница до <b>{cfg.diff_percent_offer_to_floor}%</b> topOffer/floorPrice\n"
         f"Шаг в <b>{cfg.percent_step}%</b> разницы для уведомления\n"
+        f"Падение floor на <b>{cfg.floor_drop_percent}%</b> за <b>{cfg.floor_drop_window // 60} мин</b>\n"
+        f"Рост topOffer на <b>{cfg.offer_rise_percent}%</b> за <b>{cfg.offer_rise_window // 60} мин</b>\n"
     )
     await callback.message.edit_text(configs_string, reply_markup=ConfigKeyboards.opensea_config_keyboard(), parse_mode='HTML')
     await state.clear()
@@ -53,7 +55,7 @@ async def add_to_blacklist(callback: CallbackQuery, state: FSMContext):
 
     blacklist_string = build_blacklist_string(blacklist)
     await callback.message.edit_text(
-        "Введите название коллекции для добавления в черный список" + (f"\n\nТекущий черный список:{blacklist_string}" ),
+        "Введите slug коллекции или шаблон для добавления в черный список (* - любые символы, например <code>*-pass</code>)" + (f"\n\nТекущий черный список:{blacklist_string}" ),
         reply_markup=ConfigKeyboards.opensea_config_back_keyboard(), parse_mode='HTML'
     )
     await state.update_data(message_id=callback.message.message_id)
@@ -84,6 +86,7 @@ async def remove_from_blacklist(callback: CallbackQuery, state: FSMContext):
 async def remove_all_from_blacklist(callback: CallbackQuery, state: FSMContext):
     user_id = callback.from_user.id
     BuildConfigs.opensea[user_id].blacklist.clear()
+    BuildConfigs.save_config(user_id)
     
     await callback.message.edit_text(
         "Черный список очищен.",
@@ -187,3 +190,31 @@ async def set_top_offer_floor_price_diff(callback: CallbackQuery, state: FSMCont
     await state.set_state(ConfigStates.waiting_topOffer_floorPrice_diff)
     await callback.answer()
 
+
+@router.callback_query(F.data == "opensea_floor_drop")
+async def set_floor_drop(callback: CallbackQuery, state: FSMContext):
+    cfg = BuildConfigs.opensea[callback.from_user.id]
+    await callback.message.edit_text(
+        f"Введите падение floor в % от максимума и окно в минутах (1, 5, 15 или 60), например <code>10 5</code>. "
+        f"Сейчас <b>{cfg.floor_drop_percent}%</b> за <b>{cfg.floor_drop_window // 60} мин</b>:",
+        reply_markup=ConfigKeyboards.opensea_config_back_keyboard(),
+        parse_mode='HTML'
+    )
+    await state.update_data(message_id=callback.message.message_id)
+    await state.set_state(ConfigStates.waiting_floor_drop)
+    await callback.answer()
+
+
+@router.callback_query(F.data == "opensea_offer_rise")
+async def set_offer_rise(callback: CallbackQuery, state: FSMContext):
+    cfg = BuildConfigs.opensea[callback.from_user.id]
+    await callback.message.edit_text(
+        f"Введите рост topOffer в % от минимума и окно в минутах (1, 5, 15 или 60), например <code>5 60</code>. "
+        f"Сейчас <b>{cfg.offer_rise_percent}%</b> за <b>{cfg.offer_rise_window // 60} мин</b>:",
+        reply_markup=ConfigKeyboards.opensea_config_back_keyboard(),
+        parse_mode='HTML'
+    )
+    await state.update_data(message_id=callback.message.message_id)
+    await state.set_state(ConfigStates.waiting_offer_rise)
+    await callback.answer()
+
@@ -1,5 +1,3 @@
-import asyncio
-
 from aiogram import Router, F
 from aiogram.types import Message
 from aiogram.fsm.context import FSMContext
@@ -7,6 +5,7 @@ from aiogram.fsm.context import FSMContext
 from telegram_bot.opensea.keyboards.config_keyboards import ConfigKeyboards
 from telegram_bot.opensea.states.config_states import ConfigStates
 from configs import BuildConfigs
+from OpenSea.price_history import WINDOWS
 from telegram_bot.opensea.utils import build_blacklist_string, edit_message_text
 
 router = Router()
@@ -42,7 +41,7 @@ async def process_blacklist_add(message: Message, state: FSMContext, bot):
                 parse_mode='HTML',
                 reply_markup=ConfigKeyboards.opensea_config_back_keyboard()
             )
-            asyncio.create_task(BuildConfigs.save_configs())
+            BuildConfigs.save_config(message.from_user.id)
     except:
         pass
     await message.delete()
@@ -79,7 +78,7 @@ async def process_blacklist_remove(message: Message, state: FSMContext, bot):
                 parse_mode='HTML',
                 reply_markup=ConfigKeyboards.opensea_blacklist_remove_all_keyboard() if BuildConfigs.opensea[user_id].blacklist else ConfigKeyboards.opensea_blacklist_empty_keyboard()
             )
-            asyncio.create_task(BuildConfigs.save_configs())
+            BuildConfigs.save_config(message.from_user.id)
     except:
         pass
 
@@ -98,7 +97,7 @@ async def process_notification_cooldown(message: Message, state: FSMContext, bot
                 message, state, bot
             )
             await state.clear()
-            asyncio.create_task(BuildConfigs.save_configs())
+            BuildConfigs.save_config(message.from_user.id)
         else:
             raise ValueError("Задержка не может быть отрицательной")
     except ValueError:
@@ -120,10 +119,10 @@ async def process_top_n_daily_volume(message: Message, state: FSMContext, bot):
             message, state, bot, custom_keyboard=ConfigKeyboards.opensea_config_back_keyboard()
         )
         await state.clear()
-        asyncio.create_task(BuildConfigs.save_configs())
     else:
 
         BuildConfigs.opensea[message.from_user.id].top_N_by_1d_volume = int(top_n)
+        BuildConfigs.save_config(message.from_user.id)
         await edit_message_text(
             f"✅ Топ N по 1d объему установлен: <b>{top_n}</b>.",
             message, state, bot
@@ -144,7 +143,7 @@ async def process_min_1d_volume(message: Message, state: FSMContext, bot):
                 message, state, bot
             )
             await state.clear()
-            asyncio.create_task(BuildConfigs.save_configs())
+            BuildConfigs.save_config(message.from_user.id)
         else:
             raise ValueError("Минимальный объем не может быть отрицательным")
     except ValueError:
@@ -168,7 +167,7 @@ async def process_max_1d_volume(message: Message, state: FSMContext, bot):
                 message, state, bot
             )
             await state.clear()
-            asyncio.create_task(BuildConfigs.save_configs())
+            BuildConfigs.save_config(message.from_user.id)
         else:
             raise ValueError("Максимальный объем не может быть отрицательным")
     except ValueError:
@@ -193,7 +192,7 @@ async def process_max_usd_top_offer(message: Message, state: FSMContext, bot):
                 message, state, bot
             )
             await state.clear()
-            asyncio.create_task(BuildConfigs.save_configs())
+            BuildConfigs.save_config(message.from_user.id)
             
         else:
             raise ValueError("Максимальная цена не может быть отрицательной")
@@ -219,7 +218,7 @@ async def process_min_usd_top_offer(message: Message, state: FSMContext, bot):
                 message, state, bot
             )
             await state.clear()
-            asyncio.create_task(BuildConfigs.save_configs())
+            BuildConfigs.save_config(message.from_user.id)
         else:
             raise ValueError("Минимальная цена не может быть отрицательной")
     except ValueError:
@@ -242,7 +241,7 @@ async def set_notification_percent_step(message: Message, state: FSMContext, bot
             message, state, bot
         )
         await state.clear()
-        asyncio.create_task(BuildConfigs.save_configs())
+        BuildConfigs.save_config(message.from_user.id)
     except ValueError:
         await edit_message_text(
             "❌ Пожалуйста, введите корректное значение.",
@@ -266,7 +265,7 @@ async def set_top_offer_floor_price_diff(message: Message, state: FSMContext, bo
             message, state, bot
         )
         await state.clear()
-        asyncio.create_task(BuildConfigs.save_configs())
+        BuildConfigs.save_config(message.from_user.id)
     except ValueError:
         await edit_message_text(
             "❌ Пожалуйста, введите корректное значение.",
@@ -275,4 +274,59 @@ async def set_top_offer_floor_price_diff(message: Message, state: FSMContext, bo
 
     await message.delete()
     
-    
\ No newline at end of file
+    
+
+
+def parse_window_rule(text: str) -> tuple[float, int]:
+    """Разбирает "<процент> <минуты>" в (процент, окно в секундах)"""
+    percent, minutes = text.split()
+    percent, window = float(percent), int(minutes) * 60
+
+    if percent <= 0 or window not in WINDOWS:
+        raise ValueError("Некорректное правило окна")
+
+    return percent, window
+
+
+@router.message(ConfigStates.waiting_floor_drop)
+async def set_floor_drop(message: Message, state: FSMContext, bot):
+    """Обработка установки падения floor за окно"""
+    try:
+        percent, window = parse_window_rule(message.text.strip())
+        cfg = BuildConfigs.opensea[message.from_user.id]
+        cfg.floor_drop_percent, cfg.floor_drop_window = percent, window
+        await edit_message_text(
+            f"✅ Падение floor установлено: <b>{percent}%</b> за <b>{window // 60} мин</b>.",
+            message, state, bot
+        )
+        await state.clear()
+        BuildConfigs.save_config(message.from_user.id)
+    except ValueError:
+        await edit_message_text(
+            "❌ Пожалуйста, введите процент > 0 и окно 1, 5, 15 или 60 минут, например <code>10 5</code>.",
+            message, state, bot, custom_keyboard=ConfigKeyboards.opensea_config_back_keyboard()
+        )
+
+    await message.delete()
+
+
+@router.message(ConfigStates.waiting_offer_rise)
+async def set_offer_rise(message: Message, state: FSMContext, bot):
+    """Обработка установки роста topOffer за окно"""
+    try:
+        percent, window = parse_window_rule(message.text.strip())
+        cfg = BuildConfigs.opensea[message.from_user.id]
+        cfg.offer_rise_percent, cfg.offer_rise_window = percent, window
+        await edit_message_text(
+            f"✅ Рост topOffer установлен: <b>{percent}%</b> за <b>{window // 60} мин</b>.",
+            message, state, bot
+        )
+        await state.clear()
+        BuildConfigs.save_config(message.from_user.id)
+    except ValueError:
+        await edit_message_text(
+            "❌ Пожалуйста, введите процент > 0 и окно 1, 5, 15 или 60 минут, например <code>5 60</code>.",
+            message, state, bot, custom_keyboard=ConfigKeyboards.opensea_config_back_keyboard()
+        )
+
+    await message.delete()
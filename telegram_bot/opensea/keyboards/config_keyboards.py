@@ -19,6 +19,8 @@ class ConfigKeyboards:
              InlineKeyboardButton(text="Макс USD цена",                   callback_data="opensea_max_USD_top_offer")],
             [InlineKeyboardButton(text="Разница % topOffer/floorPrice",   callback_data="opensea_topOffer_floorPrice_diff_percent")],
             [InlineKeyboardButton(text="Шаг в % разницы для уведомления", callback_data="opensea_percent_step")],
+            [InlineKeyboardButton(text="Падение floor за окно",           callback_data="opensea_floor_drop"),
+             InlineKeyboardButton(text="Рост topOffer за окно",           callback_data="opensea_offer_rise")],
             [InlineKeyboardButton(text="Назад к выбору маркетплейсов",    callback_data="config_main")]
         ])
         return keyboard
@@ -12,6 +12,8 @@ class ConfigStates(StatesGroup):
     waiting_min_USD_top_offer = State()
     waiting_topOffer_floorPrice_diff = State()
     waiting_notification_percent_step = State()
+    waiting_floor_drop = State()
+    waiting_offer_rise = State()
     
     # Состояния для работы с черным списком
     waiting_blacklist_add = State()
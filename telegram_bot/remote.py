@@ -0,0 +1,50 @@
+import logging
+
+from transport import TransportClient, TransportServer
+from configs import BuildConfigs
+
+logging.basicConfig(level=logging.WARNING)
+log = logging.getLogger(__name__)
+
+
+
+class RemoteDelivery:
+    """Роль deliver: принимает уведомления от роли evaluate и отправляет ей конфиги пользователей.
+
+    После каждого подключения к evaluate уходят все конфиги (configs), дальше - только измененные через BuildConfigs (config).
+    """
+
+    def __init__(self, notification_managers, socket_path, evaluate_path):
+        self.notification_managers = notification_managers
+
+        self.server = TransportServer(socket_path, self.handle)
+        self.configs = TransportClient(evaluate_path, on_connect=self.send_all_configs)
+
+        BuildConfigs.add_listener(self.send_config)
+
+
+
+    async def handle(self, kind: str, payload):
+        if kind != "alert":
+            log.warning(f"Unknown frame kind: {kind}")
+            return
+
+        user_id, key, message = payload
+        await self.notification_managers.add_message(user_id, message, key=key)
+
+
+
+    def send_config(self, user_id: int):
+        if (config := BuildConfigs.opensea.get(user_id)) is not None:
+            self.configs.send("config", {user_id: config.save_config()})
+
+
+
+    def send_all_configs(self):
+        self.configs.send("configs", {user_id: config.save_config() for user_id, config in BuildConfigs.opensea.items()})
+
+
+
+    async def start(self):
+        self.configs.start()
+        await self.server.start()
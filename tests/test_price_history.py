@@ -0,0 +1,41 @@
+import math
+
+from OpenSea.collection_record import CollectionRecord
+from OpenSea.price_history import PriceHistoryStore, WINDOWS
+
+
+def test_stable_then_drop_uses_price_at_window_start():
+    store = PriceHistoryStore()
+    start = 1_000_000.0
+
+    # floor 100 держится 10 минут, затем падает до 80
+    store.record(CollectionRecord("slug", floor_usd=100, offer_usd=50), start)
+    dropped = CollectionRecord("slug", floor_usd=80, offer_usd=50)
+    store.record(dropped, start + 600)
+
+    floor_drops, offer_rises = store.window_changes([dropped], start + 601)
+
+    assert floor_drops == [[20.0] * len(WINDOWS)]
+    assert offer_rises == [[0.0] * len(WINDOWS)]
+
+
+def test_baseline_is_last_sample_before_window():
+    store = PriceHistoryStore()
+    start = 1_000_000.0
+
+    store.record(CollectionRecord("slug", floor_usd=200, offer_usd=50), start)
+    store.record(CollectionRecord("slug", floor_usd=100, offer_usd=50), start + 100)
+    current = CollectionRecord("slug", floor_usd=90, offer_usd=50)
+    store.record(current, start + 1000)
+
+    (floor_drop,), _ = store.window_changes([current], start + 1001)
+
+    # 60/300/900 с: на начало окна действовал floor 100, 3600 с: максимум 200 внутри окна
+    assert [round(value, 6) for value in floor_drop] == [10.0, 10.0, 10.0, 55.0]
+
+
+def test_no_history_is_nan():
+    store = PriceHistoryStore()
+    floor_drops, _ = store.window_changes([CollectionRecord("slug", floor_usd=80, offer_usd=50)], 1.0)
+
+    assert all(math.isnan(value) for value in floor_drops[0])
@@ -0,0 +1,190 @@
+import logging
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s:%(levelname)s:%(funcName)s: %(message)s",
+    datefmt="%H:%M:%S"
+)
+logger = logging.getLogger(__name__)
+
+import asyncio, json, os, pathlib, struct
+from collections import deque
+
+
+# Кадр: длина тела uint32 big-endian и JSON [kind, payload]
+HEADER = struct.Struct(">I")
+MAX_FRAME = 64 * 1024 * 1024
+
+
+def encode_frame(kind: str, payload) -> bytes:
+    body = json.dumps([kind, payload], separators=(",", ":")).encode()
+    return HEADER.pack(len(body)) + body
+
+
+async def read_frame(reader: asyncio.StreamReader) -> tuple:
+    header = await reader.readexactly(HEADER.size)
+    (length,) = HEADER.unpack(header)
+
+    if length > MAX_FRAME:
+        raise ValueError(f"Frame of {length} bytes is too large")
+
+    kind, payload = json.loads(await reader.readexactly(length))
+    return kind, payload
+
+
+
+class TransportServer:
+    """Принимает кадры от любого числа клиентов на Unix сокете и передает их в handler(kind, payload).
+
+    Следующий кадр клиента читается только после handler, поэтому медленный получатель
+    тормозит отправителя через буфер сокета, а не копит кадры в памяти.
+    """
+
+    def __init__(self, path: pathlib.Path, handler: callable):
+        self.path = pathlib.Path(path)
+        self.handler = handler
+        self.server: asyncio.AbstractServer = None
+
+        self.stats = {
+            "clients": 0,
+            "frames": 0,
+            "errors": 0,
+        }
+
+
+
+    async def start(self):
+        # Сокет от прошлого запуска мешает bind
+        if self.path.is_socket():
+            self.path.unlink()
+
+        self.server = await asyncio.start_unix_server(self.handle_client, path=str(self.path))
+        os.chmod(self.path, 0o600)
+
+        logger.info(f"Listening on {self.path}")
+
+
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.stats["clients"] += 1
+
+        try:
+            while True:
+                kind, payload = await read_frame(reader)
+                self.stats["frames"] += 1
+
+                try:
+                    await self.handler(kind, payload)
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    logger.error(f"Error handling {kind} frame: {e}")
+
+        except asyncio.IncompleteReadError:
+            pass
+        except Exception as e:
+            logger.error(f"Client connection error: {e}")
+        finally:
+            self.stats["clients"] -= 1
+            writer.close()
+
+
+
+    async def close(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.path.is_socket():
+            self.path.unlink()
+
+
+
+class TransportClient:
+    """Отправляет кадры на Unix сокет и переподключается при обрыве.
+
+    send() не ждет: кадр встает в очередь, пока соединения нет - не больше max_pending кадров,
+    старые отбрасываются. on_connect вызывается после каждого подключения, например чтобы отправить полное состояние.
+    """
+
+    RECONNECT_DELAY = 1.0 # seconds
+
+    def __init__(self, path: pathlib.Path, on_connect: callable = None, max_pending: int = 10_000):
+        self.path = pathlib.Path(path)
+        self.on_connect = on_connect
+        self.pending: deque[bytes] = deque(maxlen=max_pending)
+        self.ready = asyncio.Event()
+        self.task: asyncio.Task = None
+
+        self.stats = {
+            "connected": 0,
+            "frames": 0,
+            "bytes": 0,
+            "dropped": 0,
+            "reconnects": 0,
+        }
+
+
+
+    def send(self, kind: str, payload):
+        if len(self.pending) == self.pending.maxlen:
+            self.stats["dropped"] += 1
+
+        self.pending.append(encode_frame(kind, payload))
+        self.ready.set()
+
+
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+
+
+    async def run(self):
+        while True:
+            try:
+                _, writer = await asyncio.open_unix_connection(str(self.path))
+            except OSError as e:
+                logger.debug(f"Waiting for {self.path}: {e}")
+                await asyncio.sleep(self.RECONNECT_DELAY)
+                continue
+
+            self.stats["connected"] = 1
+            logger.info(f"Connected to {self.path}")
+
+            try:
+                if self.on_connect:
+                    self.on_connect()
+                await self.flush(writer)
+
+            except (ConnectionError, OSError) as e:
+                logger.warning(f"Connection to {self.path} lost: {e}")
+
+            finally:
+                self.stats["connected"] = 0
+                self.stats["reconnects"] += 1
+                writer.close()
+
+            await asyncio.sleep(self.RECONNECT_DELAY)
+
+
+
+    async def flush(self, writer: asyncio.StreamWriter):
+        pending = self.pending
+        stats = self.stats
+
+        while True:
+            while pending:
+                frame = pending.popleft()
+
+                # При обрыве кадр возвращается в начало очереди и уйдет после переподключения
+                try:
+                    writer.write(frame)
+                    await writer.drain()
+                except Exception:
+                    pending.appendleft(frame)
+                    raise
+
+                stats["frames"] += 1
+                stats["bytes"] += len(frame)
+
+            self.ready.clear()
+            await self.ready.wait()